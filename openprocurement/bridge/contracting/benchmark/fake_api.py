@@ -0,0 +1,179 @@
+import json
+from collections import Counter
+from datetime import datetime, timedelta
+from random import Random
+from socket import IPPROTO_TCP, TCP_NODELAY
+from urlparse import parse_qs
+from uuid import UUID
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+
+class NoDelayWSGIServer(WSGIServer):
+    """ WSGI server that sends responses without Nagle delay
+
+    Headers and body of a response are written separately, so with Nagle
+    algorithm on the body waits for the delayed ack of the client and
+    every keep-alive request takes 40ms more.
+    """
+
+    def handle(self, sock, address):
+        sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        WSGIServer.handle(self, sock, address)
+
+
+class FakeAPI(object):
+    """ In-process imitation of tenders and contracting APIs
+
+    Serves the tenders changes feed, tender documents, tender credentials
+    and contracts with configurable latency and error rate. Every tender
+    is a complete tender without lots with `contracts_per_tender` active
+    contracts; `existing_ratio` of the contracts already exist in the
+    contracting API.
+    """
+
+    STATUSES = {200: '200 OK', 201: '201 Created', 404: '404 Not Found',
+                409: '409 Conflict', 500: '500 Internal Server Error'}
+
+    def __init__(self, tenders_count=100, contracts_per_tender=1,
+                 existing_ratio=0.0, latency=0.0, error_rate=0.0,
+                 page_size=100, seed=None):
+        self.contracts_per_tender = contracts_per_tender
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.random = Random(seed)
+        self.requests = Counter()
+        self.errors = Counter()
+        self.tenders = []
+        self.tenders_by_id = {}
+        self.contracts = {}
+        self.contracts_feed = []
+        self.created = 0
+        self.to_create = 0
+        start = datetime(2017, 1, 1)
+        for number in xrange(tenders_count):
+            tender = self._make_tender(number, start + timedelta(seconds=number))
+            self.tenders.append(tender)
+            self.tenders_by_id[tender['id']] = tender
+            for contract in tender['contracts']:
+                if self.random.random() < existing_ratio:
+                    self._add_contract(dict(contract, dateModified=tender['dateModified']))
+                else:
+                    self.to_create += 1
+
+    def _uuid(self):
+        return UUID(int=self.random.getrandbits(128)).hex
+
+    def _make_tender(self, number, date_modified):
+        items = [{'id': self._uuid(), 'description': 'Item {}'.format(number),
+                  'quantity': 1, 'deliveryDate': {'endDate': date_modified.isoformat()}}]
+        tender = {'id': self._uuid(),
+                  'tenderID': 'UA-{:010d}'.format(number),
+                  'dateModified': date_modified.isoformat(),
+                  'status': 'complete',
+                  'procurementMethodType': 'belowThreshold',
+                  'owner': 'broker',
+                  'procuringEntity': {'name': 'Procuring entity {}'.format(number)},
+                  'items': items,
+                  'awards': [],
+                  'contracts': []}
+        for i in xrange(self.contracts_per_tender):
+            award = {'id': self._uuid(), 'status': 'active'}
+            tender['awards'].append(award)
+            tender['contracts'].append({'id': self._uuid(), 'awardID': award['id'],
+                                        'status': 'active', 'contractID': 'UA-{:010d}-{}'.format(number, i)})
+        return tender
+
+    def _add_contract(self, contract):
+        self.contracts[contract['id']] = contract
+        self.contracts_feed.append(contract)
+
+    def _contracts_feed(self, params):
+        offset = int(params.get('offset', 0))
+        page = self.contracts_feed[offset:offset + int(params.get('limit', self.page_size))]
+        return {'data': [{'id': c['id'], 'dateModified': c['dateModified']} for c in page],
+                'next_page': {'offset': offset + len(page)},
+                'prev_page': {'offset': offset}}
+
+    def _feed(self, params):
+        limit = int(params.get('limit', self.page_size))
+        opt_fields = params.get('opt_fields', '').split(',')
+        if params.get('descending'):
+            offset = int(params.get('offset', len(self.tenders)))
+            page = self.tenders[max(0, offset - limit):offset][::-1]
+            next_offset = offset - len(page)
+        else:
+            offset = int(params.get('offset', 0))
+            page = self.tenders[offset:offset + limit]
+            next_offset = offset + len(page)
+        fields = set(['id', 'dateModified'] + opt_fields)
+        return {'data': [dict((k, v) for k, v in tender.items() if k in fields) for tender in page],
+                'next_page': {'offset': next_offset},
+                'prev_page': {'offset': offset}}
+
+    def handle(self, method, path, params, body):
+        parts = path.strip('/').split('/')[2:]  # skip 'api/<version>'
+        if parts == ['spore']:
+            return 200, {}
+        if parts == ['tenders'] and method == 'GET':
+            self.requests['sync_tenders'] += 1
+            return 200, self._feed(params)
+        if parts == ['contracts'] and method == 'GET':
+            self.requests['sync_contracts'] += 1
+            return 200, self._contracts_feed(params)
+
+        if parts[:1] == ['tenders'] and len(parts) == 2:
+            endpoint = 'get_tender'
+        elif parts[:1] == ['tenders'] and parts[2:] == ['extract_credentials']:
+            endpoint = 'extract_credentials'
+        elif parts == ['contracts'] and method == 'POST':
+            endpoint = 'create_contract'
+        elif parts[:1] == ['contracts'] and len(parts) == 2:
+            endpoint = 'get_contract'
+        else:
+            return 404, {'status': 'error'}
+        self.requests[endpoint] += 1
+        if self.latency:
+            gevent.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors[endpoint] += 1
+            return 500, {'status': 'error'}
+
+        if endpoint == 'create_contract':
+            contract = json.loads(body)['data']
+            if contract['id'] in self.contracts:
+                return 409, {'status': 'error'}
+            contract['dateModified'] = datetime.now().isoformat()
+            self._add_contract(contract)
+            self.created += 1
+            return 201, {'data': contract}
+        if endpoint == 'get_contract':
+            if parts[1] not in self.contracts:
+                return 404, {'status': 'error'}
+            return 200, {'data': self.contracts[parts[1]]}
+        if parts[1] not in self.tenders_by_id:
+            return 404, {'status': 'error'}
+        tender = self.tenders_by_id[parts[1]]
+        if endpoint == 'extract_credentials':
+            return 200, {'data': {'id': tender['id'], 'owner': tender['owner'],
+                                  'tender_token': tender['id'][::-1]}}
+        return 200, {'data': tender}
+
+    def __call__(self, environ, start_response):
+        params = dict((k, v[-1]) for k, v in parse_qs(environ.get('QUERY_STRING', '')).items())
+        body = ''
+        if environ['REQUEST_METHOD'] == 'POST':
+            body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        status, data = self.handle(environ['REQUEST_METHOD'], environ['PATH_INFO'], params, body)
+        response = json.dumps(data)
+        start_response(self.STATUSES[status], [('Content-Type', 'application/json'),
+                                               ('Content-Length', str(len(response)))])
+        return [response]
+
+    def serve(self, host='127.0.0.1', port=0):
+        server = NoDelayWSGIServer((host, port), self, log=None)
+        server.start()
+        self.url = 'http://{}:{}'.format(host, server.server_port)
+        return server
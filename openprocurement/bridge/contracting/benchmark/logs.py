@@ -0,0 +1,101 @@
+""" Logging overhead of the bridge per tender
+
+Tenders of the fake API go through the tender, credentials and put
+stages with in-memory clients, so only the pipeline and its logging are
+timed. Every run logs at a given level to /dev/null with a given
+formatter and the report gives CPU time per tender of every run.
+"""
+import argparse
+import json
+import logging
+import os
+from copy import deepcopy
+from time import clock
+
+import gevent
+from munch import munchify
+
+from openprocurement.bridge.contracting.benchmark.fake_api import FakeAPI
+from openprocurement.bridge.contracting.databridge import ContractingDataBridge
+from openprocurement.bridge.contracting.utils import JSONFormatter
+
+
+RUNS = (('WARNING', 'text'), ('INFO', 'text'), ('INFO', 'json'), ('DEBUG', 'json'))
+FORMATTERS = {'text': lambda: logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'),
+              'json': JSONFormatter}
+
+
+class TendersClientStub(object):
+
+    def __init__(self, tenders):
+        self.tenders = tenders
+        self.headers = {}
+
+    def get_tender(self, tender_id, extra_headers=None):
+        return {'data': self.tenders.pop(tender_id)}
+
+    def extract_credentials(self, tender_id):
+        return munchify({'data': {'id': tender_id, 'owner': 'broker', 'tender_token': tender_id[::-1]}})
+
+
+class ContractingClientStub(object):
+
+    def get_contract(self, contract_id):
+        from openprocurement_client.client import ResourceNotFound
+        raise ResourceNotFound()
+
+    def create_contract(self, data):
+        return data
+
+
+def time_run(api, level, formatter):
+    """ CPU seconds the pipeline takes to create contracts of all tenders """
+    handler = logging.StreamHandler(open(os.devnull, 'w'))
+    handler.setFormatter(FORMATTERS[formatter]())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, level))
+
+    # clients get their cookies on creation
+    server = api.serve()
+    bridge = ContractingDataBridge({'main': {
+        'tenders_api_server': api.url, 'contracting_api_server': api.url,
+        'api_token': 'benchmark', 'cache_backend': 'memory'}})
+    server.stop()
+    tenders = dict((tender['id'], munchify(deepcopy(tender))) for tender in api.tenders)
+    bridge.tenders_sync_client = bridge.client = TendersClientStub(tenders)
+    bridge.contracting_client = bridge.contracting_client_ro = ContractingClientStub()
+    jobs = [gevent.spawn(bridge.prepare_contract_data), gevent.spawn(bridge.put_contracts)]
+    started = clock()
+    for tender in api.tenders:
+        bridge._sync_tender_contracts({'id': tender['id'], 'dateModified': tender['dateModified']})
+    while bridge.metrics.get('contracts_created_total') < api.to_create:
+        gevent.sleep(0)
+    elapsed = clock() - started
+    gevent.killall(jobs)
+    handler.stream.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Logging overhead of the contracting data bridge')
+    parser.add_argument('--tenders', type=int, default=2000)
+    parser.add_argument('--contracts-per-tender', type=int, default=1, dest='contracts_per_tender')
+    parser.add_argument('--repeat', type=int, default=5, help='Best of this many runs is reported')
+    parser.add_argument('--json', action='store_true', help='Print report as JSON')
+    options = parser.parse_args()
+    api = FakeAPI(tenders_count=options.tenders, contracts_per_tender=options.contracts_per_tender, seed=1)
+    report = {}
+    for level, formatter in RUNS:
+        elapsed = min(time_run(api, level, formatter) for i in xrange(options.repeat))
+        report['{} {}'.format(level, formatter)] = round(elapsed / options.tenders * 1000000, 1)
+    if options.json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        for level, formatter in RUNS:
+            name = '{} {}'.format(level, formatter)
+            print '{:<14} {:>8} us per tender'.format(name, report[name])
+
+
+if __name__ == '__main__':
+    main()
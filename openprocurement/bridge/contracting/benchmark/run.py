@@ -0,0 +1,146 @@
+import argparse
+import json
+import logging
+import resource
+import sys
+from time import time
+
+import gevent
+
+from openprocurement.bridge.contracting.benchmark.fake_api import FakeAPI
+from openprocurement.bridge.contracting.databridge import RATE_LIMITS, ContractingDataBridge
+
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def bridge_config(api, options):
+    config = {'main': {
+        'tenders_api_server': api.url,
+        'tenders_api_version': '2.3',
+        'contracting_api_server': api.url,
+        'contracting_api_version': '2.3',
+        'api_token': 'benchmark',
+        'cache_backend': 'memory',
+        'buffers_size': options.buffers_size,
+        'feed_page_size': options.page_size,
+        'tenders_workers_count': options.tenders_workers,
+        'credentials_workers_count': options.credentials_workers,
+        'put_contracts_workers_count': options.put_workers,
+        'full_stack_sync_delay': 1,
+        'empty_stack_sync_delay': 1,
+        'jobs_watcher_delay': 1,
+        'on_error_sleep_delay': 1,
+        'retry_base_delay': 1,
+        'retry_max_delay': 5,
+        'http_trust_env': False,
+        'full_backward_sync': True,
+        'contracts_index': options.contracts_index}}
+    for kind in RATE_LIMITS:
+        config['main']['{}_rate_limit'.format(kind)] = options.rate_limit
+    return config
+
+
+def stop_bridge(bridge, runner):
+    runner.kill()
+    gevent.killall(getattr(bridge, 'jobs', []), timeout=5)
+    gevent.killall(getattr(bridge, 'immortal_jobs', {}).values(), timeout=5)
+
+
+def run_benchmark(options):
+    """ Run the bridge against a fake API until all contracts are created
+
+    Return report with throughput, per-call latency quantiles, fake API
+    request counts and peak memory of the process.
+    """
+    api = FakeAPI(tenders_count=options.tenders, contracts_per_tender=options.contracts_per_tender,
+                  existing_ratio=options.existing_ratio, latency=options.latency,
+                  error_rate=options.error_rate, page_size=options.page_size, seed=options.seed)
+    server = api.serve()
+    bridge = ContractingDataBridge(bridge_config(api, options))
+    started = time()
+    runner = gevent.spawn(bridge.run)
+    try:
+        while api.created < api.to_create and time() - started < options.timeout:
+            gevent.sleep(0.1)
+        elapsed = time() - started
+    finally:
+        stop_bridge(bridge, runner)
+        server.stop()
+
+    latency = {}
+    for (name, labels), histogram in bridge.metrics.histograms.items():
+        call = dict(labels).get('call')
+        if call is not None:
+            latency[call] = dict(('p{:g}'.format(q * 100), round(histogram.quantile(q), 4))
+                                 for q in QUANTILES)
+            latency[call]['count'] = histogram.count
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {'completed': api.created >= api.to_create,
+            'elapsed_seconds': round(elapsed, 3),
+            'tenders': options.tenders,
+            'contracts_created': api.created,
+            'contracts_expected': api.to_create,
+            'contracts_per_second': round(api.created / elapsed, 2) if elapsed else 0,
+            'tenders_processed': bridge.metrics.get('tenders_processed_total'),
+            'latency_seconds': latency,
+            'requests': dict(api.requests),
+            'injected_errors': dict(api.errors),
+            'http_connections': bridge.http_adapter.stats() if bridge.http_adapter else {},
+            'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+            'peak_rss_mb': round(usage.ru_maxrss / 1024.0, 1)}
+
+
+def format_report(report):
+    lines = ['{} in {}s: {} of {} contracts created ({} contracts/s), {} tenders processed'.format(
+                'Completed' if report['completed'] else 'Timed out',
+                report['elapsed_seconds'], report['contracts_created'],
+                report['contracts_expected'], report['contracts_per_second'],
+                report['tenders_processed']),
+             'CPU time: {}s; Peak RSS: {} MB'.format(report['cpu_seconds'], report['peak_rss_mb'])]
+    if report['http_connections']:
+        lines.append('HTTP connections opened {connections_opened}, reused {connections_reused}'.format(
+            **report['http_connections']))
+    for call, stats in sorted(report['latency_seconds'].items()):
+        lines.append('{:<20} count {:<7} p50 {:.4f}s  p90 {:.4f}s  p99 {:.4f}s'.format(
+            call, stats['count'], stats['p50'], stats['p90'], stats['p99']))
+    for endpoint, count in sorted(report['requests'].items()):
+        lines.append('{:<20} requests {:<7} injected errors {}'.format(
+            endpoint, count, report['injected_errors'].get(endpoint, 0)))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Contracting Data Bridge benchmark')
+    parser.add_argument('--tenders', type=int, default=1000, help='Number of tenders in the feed')
+    parser.add_argument('--contracts-per-tender', type=int, default=1, dest='contracts_per_tender')
+    parser.add_argument('--existing-ratio', type=float, default=0.0, dest='existing_ratio',
+                        help='Share of contracts that already exist in the contracting API')
+    parser.add_argument('--latency', type=float, default=0.01, help='Mean API response latency, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, dest='error_rate',
+                        help='Share of API requests answered with 500')
+    parser.add_argument('--page-size', type=int, default=100, dest='page_size')
+    parser.add_argument('--buffers-size', type=int, default=500, dest='buffers_size')
+    parser.add_argument('--tenders-workers', type=int, default=1, dest='tenders_workers')
+    parser.add_argument('--credentials-workers', type=int, default=1, dest='credentials_workers')
+    parser.add_argument('--put-workers', type=int, default=1, dest='put_workers')
+    parser.add_argument('--contracts-index', action='store_true', dest='contracts_index',
+                        help='Check contracts existence in the index of contracting API feed')
+    parser.add_argument('--rate-limit', type=float, dest='rate_limit',
+                        help='Requests per second of every kind of API calls')
+    parser.add_argument('--timeout', type=float, default=300, help='Give up after this many seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', action='store_true', help='Print report as JSON')
+    parser.add_argument('--log-level', default='WARNING', dest='log_level')
+    options = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, options.log_level.upper()))
+    report = run_benchmark(options)
+    if options.json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        print format_report(report)
+    sys.exit(0 if report['completed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+from time import time
+
+from requests.adapters import HTTPAdapter
+
+
+class SharedHTTPAdapter(HTTPAdapter):
+    """ HTTP adapter shared by sessions of all API clients
+
+    Keeps a pool of keep-alive connections per host, so new clients reuse
+    connections of the old ones and only connections dropped by the server
+    are opened again. Pools of hosts unused for `idle_timeout` seconds are
+    closed by `close_idle`.
+    """
+
+    def __init__(self, pool_size=10, max_hosts=10, idle_timeout=60):
+        self.idle_timeout = idle_timeout
+        self.last_used = {}
+        # counters of closed pools
+        self.closed_connections = 0
+        self.closed_requests = 0
+        super(SharedHTTPAdapter, self).__init__(pool_connections=max_hosts, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(SharedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pools.dispose_func = self._dispose_pool
+
+    def _dispose_pool(self, pool):
+        self.closed_connections += pool.num_connections
+        self.closed_requests += pool.num_requests
+        pool.close()
+
+    def get_connection(self, url, proxies=None):
+        # pool already knows its host, so the url is not parsed once more
+        pool = super(SharedHTTPAdapter, self).get_connection(url, proxies)
+        self.last_used[(pool.scheme, pool.host, pool.port)] = time()
+        return pool
+
+    def close_idle(self):
+        idle_since = time() - self.idle_timeout
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            if self.last_used.get((key.key_scheme, key.key_host, key.key_port), 0) <= idle_since:
+                del pools[key]
+
+    def stats(self):
+        pools = self.poolmanager.pools
+        pools = [pools[key] for key in pools.keys()]
+        connections = self.closed_connections + sum(pool.num_connections for pool in pools)
+        requests = self.closed_requests + sum(pool.num_requests for pool in pools)
+        return {'hosts': len(pools),
+                'connections_opened': connections,
+                'requests': requests,
+                'connections_reused': requests - connections}
@@ -10,13 +10,20 @@ except ImportError:
 import logging
 import logging.config
 import os
+import signal
+import sys
 import argparse
+import json
+from fractions import Fraction
+from functools import partial
+from operator import itemgetter
 
-from retrying import retry
+from time import time
 from uuid import uuid4
 
 import gevent
-from gevent.queue import Queue
+from gevent.event import AsyncResult
+from gevent.fileobject import FileObject
 try:  # compatibility with requests-based or restkit-based op.client.python
     from openprocurement_client.exceptions import ResourceGone
 except ImportError:
@@ -24,6 +31,7 @@ except ImportError:
 from openprocurement_client.client import TendersClientSync, TendersClient
 from openprocurement_client.contract import ContractingClient
 from openprocurement_client.client import ResourceNotFound
+from munch import munchify
 from yaml import load
 from openprocurement.bridge.contracting.journal_msg_ids import (
     DATABRIDGE_RESTART, DATABRIDGE_GET_CREDENTIALS, DATABRIDGE_GOT_CREDENTIALS,
@@ -33,13 +41,38 @@ from openprocurement.bridge.contracting.journal_msg_ids import (
     DATABRIDGE_GET_EXTRA_INFO, DATABRIDGE_WORKER_DIED, DATABRIDGE_START,
     DATABRIDGE_GOT_EXTRA_INFO, DATABRIDGE_CREATE_CONTRACT, DATABRIDGE_EXCEPTION,
     DATABRIDGE_CONTRACT_CREATED, DATABRIDGE_RETRY_CREATE, DATABRIDGE_INFO,
-    DATABRIDGE_TENDER_PROCESS, DATABRIDGE_SKIP_NOT_MODIFIED,
+    DATABRIDGE_TENDER_PROCESS, DATABRIDGE_SKIP_NOT_MODIFIED, DATABRIDGE_SKIP_SUMMARY,
     DATABRIDGE_SYNC_SLEEP, DATABRIDGE_SYNC_RESUME, DATABRIDGE_CACHED,
     DATABRIDGE_RECONNECT)
+from openprocurement.bridge.contracting.metrics import Metrics
+try:  # connections are pooled with requests-based op.client.python only
+    from openprocurement.bridge.contracting.connections import SharedHTTPAdapter
+except ImportError:
+    SharedHTTPAdapter = None
+from openprocurement.bridge.contracting.queues import (
+    DelayQueue, DurableQueue, FileJournal, MemoryQueue, RedisJournal)
+from openprocurement.bridge.contracting.utils import (
+    CircuitBreaker, EventSummary, KeyedLock, PendingLedger, RateLimiter, TenderFilter, TTLCache,
+    imap_ordered, is_conflict, paced)
 
 
 logger = logging.getLogger("openprocurement.bridge.contracting.databridge")
 INFINITY_LOOP = True
+# front cache marker of keys known to exist in the backend
+EXISTS = object()
+SYNC_POINT_KEY = 'contracting_databridge_sync_point'
+PENDING_CONTRACTS_KEY = 'contracting_databridge_pending_contracts'
+CONTRACTS_INDEX_KEY = 'contracting_databridge_contracts_index'
+DEAD_LETTERS_KEY = 'contracting_databridge_dead_letters'
+# lanes of tenders queue
+FRESH_LANE, BACKLOG_LANE = 0, 1
+RATE_LIMITS = ('tenders_read', 'tenders_write', 'contracting_read', 'contracting_write')
+UPSTREAMS = ('tenders_read', 'tenders_credentials', 'contracting_read', 'contracting_write')
+CREDENTIALS_ATTEMPTS = 3
+QUEUE_NAMES = ('tenders_queue', 'handicap_contracts_queue', 'handicap_contracts_queue_retry',
+               'contracts_put_queue', 'contracts_retry_put_queue')
+TENDER_STATUSES = ("active.qualification", "active", "active.awarded", "complete")
+SKIP_PROCUREMENT_METHOD_TYPES = ('competitiveDialogueUA', 'competitiveDialogueEU', 'esco')
 
 
 class Db(object):
@@ -52,6 +85,11 @@ class Db(object):
         self._db_name = None
         self._port = None
         self._host = None
+        self.front_cache = None
+
+        if self.config.get('cache_front_size'):
+            self.front_cache = TTLCache(self.config.get('cache_front_ttl') or 60,
+                                        maxsize=self.config['cache_front_size'])
 
         if 'cache_host' in self.config:
             import redis
@@ -63,6 +101,18 @@ class Db(object):
                                         db=self._db_name)
             self.set_value = self.db.set
             self.has_value = self.db.exists
+            self.has_values = self._redis_has_values
+            self.get_values = self.db.mget
+            self.set_values = self._redis_set_values
+        elif self.config.get('cache_backend') == 'memory':
+            self._backend = "memory"
+            self._db_name = 'memory'
+            self.db = {}
+            self.set_value = self.db.__setitem__
+            self.has_value = self.db.__contains__
+            self.has_values = lambda keys: [key in self.db for key in keys]
+            self.get_values = lambda keys: [self.db.get(key) for key in keys]
+            self.set_values = self._set_values
         else:
             from lazydb import Db
             self._backend = "lazydb"
@@ -70,31 +120,130 @@ class Db(object):
             self.db = Db(self._db_name)
             self.set_value = self.db.put
             self.has_value = self.db.has
+            self.has_values = lambda keys: [self.db.has(key) for key in keys]
+            self.get_values = lambda keys: [self.db.get(key) for key in keys]
+            self.set_values = self._set_values
+
+
+    def _redis_has_values(self, keys):
+        pipe = self.db.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(key)
+        return pipe.execute()
+
+    def _redis_set_values(self, items):
+        pipe = self.db.pipeline(transaction=False)
+        for key, value in items:
+            pipe.set(key, value)
+        pipe.execute()
+
+    def _set_values(self, items):
+        for key, value in items:
+            self.set_value(key, value)
+
+    def _front_get(self, key):
+        if self.front_cache is None:
+            return None
+        return self.front_cache.get(key)
 
+    def _front_put(self, key, value):
+        if self.front_cache is not None and value is not None:
+            self.front_cache.put(key, value)
 
     def get(self, key):
-        return self.db.get(key)
+        value = self._front_get(key)
+        if value is None or value is EXISTS:
+            value = self.db.get(key)
+            self._front_put(key, value)
+        return value
 
     def put(self, key, value):
         self.set_value(key, value)
+        self._front_put(key, value)
 
     def has(self, key):
-        return self.has_value(key)
+        if self._front_get(key) is not None:
+            return True
+        exists = self.has_value(key)
+        if exists:
+            self._front_put(key, EXISTS)
+        return exists
+
+    def get_many(self, keys):
+        values = [self._front_get(key) for key in keys]
+        missed = [key for key, value in zip(keys, values) if value is None or value is EXISTS]
+        if missed:
+            found = dict(zip(missed, self.get_values(missed)))
+            for key, value in found.items():
+                self._front_put(key, value)
+            values = [found[key] if key in found else value
+                      for key, value in zip(keys, values)]
+        return values
+
+    def put_many(self, items):
+        items = list(items)
+        if items:
+            self.set_values(items)
+            for key, value in items:
+                self._front_put(key, value)
+
+    def has_many(self, keys):
+        exists = [self._front_get(key) is not None for key in keys]
+        missed = [key for key, value in zip(keys, exists) if not value]
+        if missed:
+            found = dict(zip(missed, [bool(value) for value in self.has_values(missed)]))
+            for key in missed:
+                if found[key]:
+                    self._front_put(key, EXISTS)
+            exists = [found.get(key, value) for key, value in zip(keys, exists)]
+        return exists
+
+
+def read_tender_ids(lines):
+    """ Tender ids of lines without blanks, comments and repeats """
+    seen = set()
+    for line in lines:
+        tender_id = line.strip()
+        if tender_id and not tender_id.startswith('#') and tender_id not in seen:
+            seen.add(tender_id)
+            yield tender_id
 
 
 def generate_req_id():
     return b'contracting-data-bridge-req-' + str(uuid4()).encode('ascii')
 
 
-def journal_context(record={}, params={}):
-    for k, v in params.items():
-        record["JOURNAL_" + k] = v
-    return record
+def journal_context(record=None, params=None):
+    """ Journal fields of log record, a new dict on every call """
+    context = dict(record) if record else {}
+    if params:
+        for k, v in params.items():
+            context["JOURNAL_" + k] = v
+    return context
+
+
+def log_event(level, message_id, params, message, *args):
+    """ Log message of the hot path
+
+    Message is formatted with `args` by the logging call and journal
+    fields are built only when `level` is enabled. The record is made here
+    rather than by `logger.log`, so its location fields (journald
+    CODE_FUNC and CODE_LINE) name the caller and not this helper.
+    """
+    if logger.isEnabledFor(level):
+        caller = sys._getframe(1)
+        logger.handle(logger.makeRecord(
+            logger.name, level, caller.f_code.co_filename, caller.f_lineno, message, args, None,
+            caller.f_code.co_name, journal_context({"MESSAGE_ID": message_id} if message_id else None, params)))
 
 
 class ContractingDataBridge(object):
     """ Contracting Data Bridge """
 
+    pending_contracts_key = PENDING_CONTRACTS_KEY
+    queues_journal_name = 'contracting_databridge_queues'
+    dead_letters_name = 'contracts'
+
     def __init__(self, config):
         super(ContractingDataBridge, self).__init__()
         self.config = config
@@ -118,6 +267,42 @@ class ContractingDataBridge(object):
         queue_size = self.config_get('buffers_size') or 500
         self.full_stack_sync_delay = self.config_get('full_stack_sync_delay') or 15
         self.empty_stack_sync_delay = self.config_get('empty_stack_sync_delay') or 101
+        self.feed_page_size = self.config_get('feed_page_size') or 100
+        self.tender_filter = TenderFilter(
+            self.config_get('tender_statuses', TENDER_STATUSES),
+            self.config_get('skip_procurement_method_types', SKIP_PROCUREMENT_METHOD_TYPES),
+            self.config_get('lot_statuses', ('complete',)),
+            self.config_get('nolot_tender_statuses', ('complete',)))
+        # skipped tenders are logged one by one only with this debug switch,
+        # otherwise as summaries of skip_summary_interval seconds
+        self.log_skipped_tenders = self.config_get('log_skipped_tenders') or False
+        self.skip_summaries = dict(
+            (direction, EventSummary(partial(self._log_skip_summary, direction),
+                                     self.config_get('skip_summary_interval') or 60,
+                                     self.config_get('skip_summary_samples') or 5))
+            for direction in ('forward', 'backward'))
+        self.tenders_workers_count = self.config_get('tenders_workers_count') or 1
+        self.credentials_workers_count = self.config_get('credentials_workers_count') or 1
+        self.credentials_cache_ttl = self.config_get('credentials_cache_ttl') or 30
+        self.put_contracts_workers_count = self.config_get('put_contracts_workers_count') or 1
+        self.sync_checkpoint_interval = self.config_get('sync_checkpoint_interval') or 60
+        self.full_backward_sync = self.config_get('full_backward_sync') or False
+        self.persist_pending_contracts = self.config_get('persist_pending_contracts') or False
+        self.metrics_host = self.config_get('metrics_host') or '127.0.0.1'
+        self.metrics_port = self.config_get('metrics_port')
+        self.contracts_index = self.config_get('contracts_index') or False
+        self.contracts_index_max_lag = self.config_get('contracts_index_max_lag') or 300
+        self.queue_backend = self.config_get('queue_backend') or 'memory'
+        self.drain_timeout = self.config_get('drain_timeout') or 60
+        # share of tenders queue gets given to backward sync tenders while
+        # there are fresh ones
+        backlog_share = self.config_get('backlog_share', 0.1)
+        if not 0 <= backlog_share < 1:
+            raise ValueError('backlog_share {} is out of [0, 1) range'.format(backlog_share))
+        # the fresh lane keeps a share even when rounding gives all to the backlog
+        backlog_share = min(Fraction(backlog_share).limit_denominator(100), Fraction(99, 100))
+        self.tenders_queue_weights = (backlog_share.denominator - backlog_share.numerator,
+                                      backlog_share.numerator)
 
         self.api_server = self.config_get('tenders_api_server')
         self.api_version = self.config_get('tenders_api_version')
@@ -126,65 +311,261 @@ class ContractingDataBridge(object):
         self.contracting_api_server = self.config_get('contracting_api_server')
         self.contracting_api_version = self.config_get('contracting_api_version')
 
+        self.http_adapter = None
+        if SharedHTTPAdapter is not None:
+            # by default every concurrent request of the workers has its connection
+            pool_size = max(10, self.tenders_workers_count + self.credentials_workers_count +
+                            self.put_contracts_workers_count + 4)
+            self.http_adapter = SharedHTTPAdapter(self.config_get('http_pool_size') or pool_size,
+                                                  self.config_get('http_pool_hosts') or 10,
+                                                  self.config_get('http_idle_timeout') or 60)
+        # proxies and netrc from the environment are looked up on every request
+        self.http_trust_env = self.config_get('http_trust_env', True)
         self.clients_initialize()
 
         self.initial_sync_point = {}
+        self.sync_point = {}
+        self.sync_point_saved_at = 0
+        self.contracts_index_state = {}
+        self.contracts_index_checked_at = None
         self.initialization_event = gevent.event.Event()
-        self.tenders_queue = Queue(maxsize=queue_size)
-        self.handicap_contracts_queue = Queue(maxsize=queue_size)
-        self.handicap_contracts_queue_retry = Queue(maxsize=queue_size)
-        self.contracts_put_queue = Queue(maxsize=queue_size)
-        self.contracts_retry_put_queue = Queue(maxsize=queue_size)
-        self.basket = {}
+        self.stopping_at = None
+        self.queues_journal = self.queues_journal_init()
+        for name in QUEUE_NAMES:
+            options = {'maxsize': queue_size}
+            if name == 'tenders_queue':
+                # one waiting entry per tender with the newest dateModified
+                options.update(weights=self.tenders_queue_weights,
+                               key=itemgetter('id'), version=itemgetter('dateModified'))
+            if self.queues_journal is None:
+                setattr(self, name, MemoryQueue(**options))
+            else:
+                setattr(self, name, DurableQueue(self.queues_journal, name, **options))
+        # failed contracts wait here and go back to their retry queue when due
+        self.retry_delays = DelayQueue(self.config_get('retry_base_delay') or 60,
+                                       self.config_get('retry_max_delay') or 3600,
+                                       self.config_get('retry_max_attempts') or 15)
+        # contracts that ran out of attempts, the store is opened on the first one
+        self.dead_letters = None
+        # requests per second of every kind, unlimited by default
+        self.rate_limits = dict((name, RateLimiter(self.config_get('{}_rate_limit'.format(name)),
+                                                   self.config_get('{}_rate_burst'.format(name)) or 1))
+                                for name in RATE_LIMITS)
+        self.breakers = dict((name, CircuitBreaker(name, self.config_get('breaker_failure_threshold') or 10,
+                                                   self.config_get('breaker_reset_timeout') or 30,
+                                                   on_change=self._breaker_changed))
+                             for name in UPSTREAMS)
+        self.pending_contracts = PendingLedger(self.config_get('pending_contracts_limit') or 100000,
+                                               self.config_get('pending_contracts_max_age'))
+        if self.persist_pending_contracts:
+            self.load_pending_contracts()
+        self.tenders_locks = KeyedLock()
+        self.credentials_cache = TTLCache(self.credentials_cache_ttl)
+        self.credentials_requests = {}
+        self.metrics = Metrics()
+        self.metrics_server = None
+        for name in QUEUE_NAMES:
+            self.metrics.gauge('queue_size', self._queue_size_getter(name), queue=name)
+        self.metrics.gauge('tenders_queue_lane_size', lambda: self.tenders_queue.lane_size(FRESH_LANE), lane='fresh')
+        self.metrics.gauge('tenders_queue_lane_size', lambda: self.tenders_queue.lane_size(BACKLOG_LANE), lane='backlog')
+        self.metrics.gauge('tenders_queue_coalesced', lambda: self.tenders_queue.coalesced)
+        self.metrics.gauge('retry_delayed_contracts', lambda: len(self.retry_delays))
+        for name in RATE_LIMITS:
+            self.metrics.gauge('rate_limit_wait_seconds', self._rate_limit_getter(name, 'waited'), kind=name)
+            self.metrics.gauge('rate_limit_pauses', self._rate_limit_getter(name, 'pauses'), kind=name)
+        for name in UPSTREAMS:
+            self.metrics.gauge('circuit_breaker_open', self._breaker_open_getter(name), upstream=name)
+        if self.http_adapter is not None:
+            for name in ('hosts', 'connections_opened', 'connections_reused', 'requests'):
+                self.metrics.gauge('http_' + name, self._http_stats_getter(name))
+        self.metrics.gauge('pending_contracts', lambda: len(self.pending_contracts))
+        self.metrics.gauge('pending_contracts_oldest_age_seconds', lambda: self.pending_contracts.oldest_age())
+        if self.cache_db.front_cache is not None:
+            self.metrics.gauge('cache_front_hits', lambda: self.cache_db.front_cache.hits)
+            self.metrics.gauge('cache_front_misses', lambda: self.cache_db.front_cache.misses)
+
+    def queues_journal_init(self):
+        if self.queue_backend == 'memory':
+            return
+        if self.queue_backend == 'redis':
+            if self.cache_db._backend != 'redis':
+                raise ValueError('Redis queue backend requires redis cache backend')
+            journal = RedisJournal(self.cache_db.db, self.queues_journal_name)
+        elif self.queue_backend == 'file':
+            path = os.path.join(self.config_get('queue_dir') or '.', self.queues_journal_name + '.log')
+            journal = FileJournal(path, fsync=self.config_get('queue_fsync') or False)
+        else:
+            raise ValueError('Unknown queue backend {}'.format(self.queue_backend))
+        logger.info('Queues journal backend: {}'.format(self.queue_backend),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+        return journal
+
+    def _queue_size_getter(self, name):
+        # queues may be replaced, so they are looked up on every scrape
+        return lambda: getattr(self, name).qsize()
+
+    def _http_stats_getter(self, name):
+        return lambda: self.http_adapter.stats()[name]
+
+    def _rate_limit_getter(self, name, attr):
+        return lambda: getattr(self.rate_limits[name], attr)
+
+    def _breaker_open_getter(self, name):
+        return lambda: int(self.breakers[name].state != CircuitBreaker.CLOSED)
+
+    def _breaker_changed(self, breaker):
+        logger.warn('Circuit breaker of {} upstream is {}'.format(breaker.name, breaker.state),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+        if breaker.state != CircuitBreaker.OPEN:
+            return
+        self.metrics.inc('circuit_breaker_opened_total', upstream=breaker.name)
+        # trial requests may go to another server after reconnect
+        if breaker.name == 'tenders_credentials':
+            logger.info("Reconnecting tenders client", extra=journal_context({"MESSAGE_ID": DATABRIDGE_RECONNECT}, {}))
+            self.client = self._pooled(TendersClient(self.config_get('api_token'),
+                host_url=self.api_server, api_version=self.api_version))
+        elif breaker.name == 'contracting_write':
+            logger.info("Reconnecting contract client", extra=journal_context({"MESSAGE_ID": DATABRIDGE_RECONNECT}, {}))
+            self.contracting_client_init()
+
+    def _pooled(self, client):
+        # the session keeps its cookies, so a new client still gets a new server
+        session = getattr(client, 'session', None)
+        if session is None:
+            return client
+        session.trust_env = self.http_trust_env
+        if self.http_adapter is not None:
+            session.mount('http://', self.http_adapter)
+            session.mount('https://', self.http_adapter)
+        return client
 
     def contracting_client_init(self):
         logger.info('Initialization contracting clients.',  extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
-        self.contracting_client = ContractingClient(
+        self.contracting_client = self._pooled(ContractingClient(
             self.config_get('api_token'),
             host_url=self.contracting_api_server, api_version=self.contracting_api_version
-        )
+        ))
 
         self.contracting_client_ro = self.contracting_client
         if self.config_get('public_tenders_api_server'):
             if self.api_server == self.contracting_api_server and self.api_version == self.contracting_api_version:
-                self.contracting_client_ro = ContractingClient(
+                self.contracting_client_ro = self._pooled(ContractingClient(
                     '',
                     host_url=self.ro_api_server, api_version=self.api_version
-                )
+                ))
 
     def clients_initialize(self):
-        self.client = TendersClient(
+        self.client = self._pooled(TendersClient(
             self.config_get('api_token'),
             host_url=self.api_server, api_version=self.api_version,
-        )
+        ))
 
         self.contracting_client_init()
 
-        self.tenders_sync_client = TendersClientSync('',
+        self.tenders_sync_client = self._pooled(TendersClientSync('',
             host_url=self.ro_api_server, api_version=self.api_version,
-        )
+        ))
 
-    def config_get(self, name):
-        return self.config.get('main').get(name)
+    def config_get(self, name, default=None):
+        return self.config.get('main').get(name, default)
 
-    @retry(stop_max_attempt_number=3, wait_exponential_multiplier=1000)
     def get_tender_credentials(self, tender_id):
+        # retrying decorator sets up a logging handler on every call
+        for attempt in xrange(1, CREDENTIALS_ATTEMPTS + 1):
+            try:
+                return self._extract_credentials(tender_id)
+            except Exception:
+                if attempt == CREDENTIALS_ATTEMPTS:
+                    raise
+                gevent.sleep(2 ** attempt)
+
+    def _extract_credentials(self, tender_id):
         self.client.headers.update({'X-Client-Request-ID': generate_req_id()})
-        logger.info("Getting credentials for tender {}".format(tender_id), extra=journal_context({"MESSAGE_ID": DATABRIDGE_GET_CREDENTIALS},
-                                                                                                 {"TENDER_ID": tender_id}))
-        data = self.client.extract_credentials(tender_id)
-        logger.info("Got tender {} credentials".format(tender_id), extra=journal_context({"MESSAGE_ID": DATABRIDGE_GOT_CREDENTIALS},
-                                                                                         {"TENDER_ID": tender_id}))
+        log_event(logging.INFO, DATABRIDGE_GET_CREDENTIALS, {"TENDER_ID": tender_id},
+                  "Getting credentials for tender %s", tender_id)
+        with self.rate_limits['tenders_write'], self.metrics.timer('request_duration_seconds', call='extract_credentials'):
+            data = self.client.extract_credentials(tender_id)
+        log_event(logging.INFO, DATABRIDGE_GOT_CREDENTIALS, {"TENDER_ID": tender_id},
+                  "Got tender %s credentials", tender_id)
         return data
 
+    def get_tender_credentials_shared(self, tender_id):
+        """ Get tender credentials sharing the result between contracts
+
+        Contracts of one tender wait for a single in-flight request and
+        reuse its result while it stays in the credentials cache.
+        """
+        tender_data = self.credentials_cache.get(tender_id)
+        if tender_data is not None:
+            return tender_data
+        if tender_id in self.credentials_requests:
+            return self.credentials_requests[tender_id].get()
+        request = self.credentials_requests[tender_id] = AsyncResult()
+        try:
+            with self.breakers['tenders_credentials']:
+                tender_data = self.get_tender_credentials(tender_id)
+                assert 'owner' in tender_data.data
+                assert 'tender_token' in tender_data.data
+        except Exception, e:
+            request.set_exception(e)
+            raise
+        else:
+            self.credentials_cache.put(tender_id, tender_data)
+            request.set(tender_data)
+            return tender_data
+        finally:
+            if not request.ready():
+                # owner greenlet is killed, waiters must not wait forever
+                request.set_exception(RuntimeError('Credentials request of tender {} is interrupted'.format(tender_id)))
+            del self.credentials_requests[tender_id]
+
+    def load_sync_point(self):
+        if self.sync_point:
+            return dict(self.sync_point)
+        if self.full_backward_sync:
+            return {}
+        sync_point = self.cache_db.get(SYNC_POINT_KEY)
+        if not sync_point:
+            return {}
+        sync_point = json.loads(sync_point)
+        # offsets move past tenders once they are queued, so tenders left in
+        # memory queues of the previous run are found by full sync only
+        if not sync_point.pop('drained', False) and self.queues_journal is None:
+            logger.warn('Previous run was not drained and queues are not durable, '
+                        'saved sync point is ignored', extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+            return {}
+        return sync_point
+
+    def save_sync_point(self, force=False, drained=False):
+        if force or time() - self.sync_point_saved_at >= self.sync_checkpoint_interval:
+            sync_point = dict(self.sync_point, drained=True) if drained else self.sync_point
+            self.cache_db.put(SYNC_POINT_KEY, json.dumps(sync_point))
+            self.sync_point_saved_at = time()
+
+    def _sync_tenders(self, params):
+        with self.rate_limits['tenders_read']:
+            return self.tenders_sync_client.sync_tenders(params, extra_headers={'X-Client-Request-ID': generate_req_id()})
+
     def initialize_sync(self, params=None, direction=None):
-        self.initialization_event.clear()
         if direction == "backward":
             assert params['descending']
-            response = self.tenders_sync_client.sync_tenders(params, extra_headers={'X-Client-Request-ID': generate_req_id()})
+            sync_point = self.load_sync_point()
+            if sync_point:
+                self.sync_point = sync_point
+                self.initial_sync_point = dict(sync_point)
+                self.initialization_event.set()  # wake up forward worker
+                logger.info("Resume sync from point {}".format(self.initial_sync_point),
+                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+                if not sync_point['backward_offset']:
+                    return  # backward sync is already finished
+                params['offset'] = sync_point['backward_offset']
+                return self._sync_tenders(params)
+            response = self._sync_tenders(params)
             # set values in reverse order due to 'descending' option
             self.initial_sync_point = {'forward_offset': response.prev_page.offset,
                                        'backward_offset': response.next_page.offset}
+            self.sync_point = dict(self.initial_sync_point)
+            self.save_sync_point(force=True)
             self.initialization_event.set()  # wake up forward worker
             logger.info("Initial sync point {}".format(self.initial_sync_point))
             return response
@@ -193,82 +574,215 @@ class ContractingDataBridge(object):
             gevent.wait([self.initialization_event])
             params['offset'] = self.initial_sync_point['forward_offset']
             logger.info("Starting forward sync from offset {}".format(params['offset']))
-            return self.tenders_sync_client.sync_tenders(params, extra_headers={'X-Client-Request-ID': generate_req_id()})
+            return self._sync_tenders(params)
+
+    def _log_skip_summary(self, direction, counts, sample_ids, elapsed):
+        reasons = sorted(counts)
+        params = {"SKIPPED": sum(counts.values())}
+        for reason in reasons:
+            params["SKIPPED_" + reason.upper()] = counts[reason]
+            params["SKIPPED_{}_SAMPLES".format(reason.upper())] = ','.join(sample_ids[reason])
+        logger.info('{} sync: Skipped {} tenders in {:.0f}s ({}), for example {}'.format(
+                        direction.capitalize(), params["SKIPPED"], elapsed,
+                        ', '.join('{} {}'.format(counts[reason], reason.replace('_', ' ')) for reason in reasons),
+                        '; '.join('{} {}'.format(reason.replace('_', ' '), ', '.join(sample_ids[reason])) for reason in reasons)),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_SKIP_SUMMARY}, params))
+
+    def get_sync_delay(self, tenders_count, last_delay=0):
+        """ Delay before the next feed request
+
+        Full pages are followed immediately, partially filled pages wait up
+        to full_stack_sync_delay and every next empty page doubles the delay
+        up to empty_stack_sync_delay.
+        """
+        if tenders_count >= self.feed_page_size:
+            return 0
+        if tenders_count:
+            fill_ratio = float(tenders_count) / self.feed_page_size
+            return self.full_stack_sync_delay * (1 - fill_ratio)
+        return min(max(last_delay * 2, self.full_stack_sync_delay), self.empty_stack_sync_delay)
 
     def get_tenders(self, params={}, direction=""):
         response = self.initialize_sync(params=params, direction=direction)
+        if response is None:
+            return
 
+        delay = 0
         while not (params.get('descending') and not len(response.data) and params.get('offset') == response.next_page.offset):
             tenders_list = response.data
             params['offset'] = response.next_page.offset
 
-            delay = self.empty_stack_sync_delay
+            delay = self.get_sync_delay(len(tenders_list), delay)
             if tenders_list:
-                delay = self.full_stack_sync_delay
-                logger.info("Client {} params: {}".format(direction, params))
+                log_event(logging.INFO, None, None, "Client %s params: %s", direction, params)
+            tenders = []
             for tender in tenders_list:
-                if tender.get('procurementMethodType') in ['competitiveDialogueUA', 'competitiveDialogueEU', 'esco']:
-                    logger.info('Skipping {} tender {}'.format(tender['procurementMethodType'], tender['id']),
-                                extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, params={"TENDER_ID": tender['id']}))
+                if self.tender_filter(tender):
+                    tenders.append(tender)
                     continue
-                if tender['status'] in ("active.qualification", "active",
-                                        "active.awarded", "complete"):
-                    if hasattr(tender, "lots"):
-                        if any([1 for lot in tender['lots'] if lot['status'] == "complete"]):
-                            logger.info('{} sync: Found multilot tender {} in status {}'.format(direction.capitalize(), tender['id'], tender['status']),
-                                        extra=journal_context({"MESSAGE_ID": DATABRIDGE_FOUND_MULTILOT_COMPLETE}, {"TENDER_ID": tender['id']}))
-                            yield tender
-                    elif tender['status'] == "complete":
-                        logger.info('{} sync: Found tender in complete status {}'.format(direction.capitalize(), tender['id']),
-                                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_FOUND_NOLOT_COMPLETE}, {"TENDER_ID": tender['id']}))
-                        yield tender
+                self.skip_summaries[direction].add('filtered', tender['id'])
+                if self.log_skipped_tenders:
+                    logger.debug('{} sync: Skip tender {} in status {}'.format(direction.capitalize(), tender['id'], tender['status']))
+            self.metrics.inc('tenders_seen_total', len(tenders_list), direction=direction)
+            self.metrics.inc('tenders_skipped_total', len(tenders_list) - len(tenders), reason='filtered')
+            if len(tenders) < len(tenders_list):
+                log_event(logging.DEBUG, None, None, '%s sync: Skipped %s of %s tenders',
+                          direction.capitalize(), len(tenders_list) - len(tenders), len(tenders_list))
+            for tender in tenders:
+                if 'lots' in tender:
+                    log_event(logging.INFO, DATABRIDGE_FOUND_MULTILOT_COMPLETE, {"TENDER_ID": tender['id']},
+                              '%s sync: Found multilot tender %s in status %s', direction.capitalize(), tender['id'], tender['status'])
                 else:
-                    logger.debug('{} sync: Skipping tender {} in status {}'.format(direction.capitalize(), tender['id'], tender['status']),
-                                 extra=journal_context(params={"TENDER_ID": tender['id']}))
+                    log_event(logging.INFO, DATABRIDGE_FOUND_NOLOT_COMPLETE, {"TENDER_ID": tender['id']},
+                              '%s sync: Found tender in complete status %s', direction.capitalize(), tender['id'])
+                yield tender
+
+            # all tenders of the page are handed over to the tenders queue
+            self.sync_point['{}_offset'.format(direction)] = params['offset']
+            self.save_sync_point()
+            self.skip_summaries[direction].flush_due()
+            if delay:
+                log_event(logging.INFO, DATABRIDGE_SYNC_SLEEP, None, 'Sleep %s sync...', direction)
+                gevent.sleep(delay)
+                log_event(logging.INFO, DATABRIDGE_SYNC_RESUME, None, 'Restore %s sync', direction)
+            else:
+                gevent.sleep(0)
+            log_event(logging.DEBUG, None, None, '%s %s', direction, params)
+            response = self._sync_tenders(params)
 
-            logger.info('Sleep {} sync...'.format(direction), extra=journal_context({"MESSAGE_ID": DATABRIDGE_SYNC_SLEEP}))
+        self.skip_summaries[direction].flush()
+        if direction == "backward":
+            self.sync_point['backward_offset'] = None
+            self.save_sync_point(force=True)
+
+    def load_pending_contracts(self):
+        pending_contracts = self.cache_db.get(self.pending_contracts_key)
+        if pending_contracts:
+            self.pending_contracts.load(json.loads(pending_contracts))
+            logger.info("Loaded {} pending contracts".format(len(self.pending_contracts)),
+                        extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+
+    def requeue_pending_tenders(self):
+        for tender_id, date_modified in self.pending_contracts.tenders():
+            self.tenders_queue.put({'id': tender_id, 'dateModified': date_modified}, lane=BACKLOG_LANE)
+
+    def save_pending_contracts(self):
+        self.cache_db.put(self.pending_contracts_key, json.dumps(self.pending_contracts.dump()))
+
+    def contracts_index_client_init(self):
+        if self.config_get('public_tenders_api_server') and self.api_server == self.contracting_api_server:
+            host_url = self.ro_api_server
+        else:
+            host_url = self.contracting_api_server
+        self.contracts_index_client = self._pooled(ContractingClient('', host_url=host_url,
+                                                                     api_version=self.contracting_api_version))
+
+    def sync_contracts_index(self):
+        """ Put ids of contracts from contracting API feed in cache """
+        logger.info('Start contracts index sync worker...')
+        self.contracts_index_client_init()
+        if not self.contracts_index_state:
+            state = self.cache_db.get(CONTRACTS_INDEX_KEY)
+            self.contracts_index_state = json.loads(state) if state else {}
+        if self.contracts_index_state.get('offset'):
+            self.contracts_index_client.params['offset'] = self.contracts_index_state['offset']
+        delay = 0
+        while INFINITY_LOOP:
+            try:
+                with self.rate_limits['contracting_read']:
+                    contracts = self.contracts_index_client.get_contracts({'limit': self.feed_page_size}) or []
+            except Exception, e:
+                logger.warn('Fail to get contracts feed page', extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {}))
+                logger.exception(e)
+                gevent.sleep(self.on_error_delay)
+                raise
+            if contracts:
+                self.cache_db.put_many([(contract['id'], True) for contract in contracts])
+                self.contracts_index_state['synced_until'] = contracts[-1]['dateModified']
+                self.metrics.inc('contracts_indexed_total', len(contracts))
+            if len(contracts) < self.feed_page_size:
+                if self.contracts_index_checked_at is None:
+                    logger.info('Contracts index caught up with contracting API feed',
+                                extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+                self.contracts_index_checked_at = time()
+            self.contracts_index_state['offset'] = self.contracts_index_client.params.get('offset')
+            self.cache_db.put(CONTRACTS_INDEX_KEY, json.dumps(self.contracts_index_state))
+            delay = self.get_sync_delay(len(contracts), delay)
             gevent.sleep(delay)
-            logger.info('Restore {} sync'.format(direction), extra=journal_context({"MESSAGE_ID": DATABRIDGE_SYNC_RESUME}))
-            logger.debug('{} {}'.format(direction, params))
-            response = self.tenders_sync_client.sync_tenders(params, extra_headers={'X-Client-Request-ID': generate_req_id()})
+
+    def contracts_index_covers(self, date_modified):
+        """ Whether contracts of tender modified at `date_modified` are in the index
+
+        It is so when the index is in sync with the head of contracting API
+        feed and has already passed contracts modified after the tender.
+        Contracts of more recent tenders have to be looked up in the API.
+        """
+        return (self.contracts_index_checked_at is not None and
+                time() - self.contracts_index_checked_at <= self.contracts_index_max_lag and
+                date_modified < self.contracts_index_state.get('synced_until', ''))
 
     def _put_tender_in_cache_by_contract(self, contract, tender_id):
-        dateModified = self.basket.get(contract['id'])
+        # tender is saved in cache when all its active contracts are handled
+        dateModified = self.pending_contracts.done(contract['id'])
         if dateModified:
-            # TODO: save tender in cache only if all active contracts are
-            # handled successfully
             self.cache_db.put(tender_id, dateModified)
-        self.basket.pop(contract['id'], None)
 
     def _get_tender_contracts(self):
+        self.breakers['tenders_read'].wait()
+        self.breakers['contracting_read'].wait()
+        lane, tender_to_sync = self.tenders_queue.get_entry()
+        try:
+            # the same tender may be queued by both sync workers, so only one
+            # tender worker at a time is allowed to handle its contracts
+            with self.tenders_locks(tender_to_sync['id']):
+                self._sync_tender_contracts(tender_to_sync, lane)
+        finally:
+            # failed tender is put back as a new delivery
+            self.tenders_queue.ack(tender_to_sync)
+
+    def _sync_tender_contracts(self, tender_to_sync, lane=FRESH_LANE):
         try:
-            tender_to_sync = self.tenders_queue.get()
-            tender = self.tenders_sync_client.get_tender(tender_to_sync['id'],
-                                                         extra_headers={'X-Client-Request-ID': generate_req_id()})['data']
+            with self.rate_limits['tenders_read'], self.breakers['tenders_read'], \
+                    self.metrics.timer('request_duration_seconds', call='get_tender'):
+                tender = self.tenders_sync_client.get_tender(tender_to_sync['id'],
+                                                             extra_headers={'X-Client-Request-ID': generate_req_id()})['data']
         except Exception, e:
             logger.warn('Fail to get tender info {}'.format(tender_to_sync['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, params={"TENDER_ID": tender_to_sync['id']}))
             logger.exception(e)
             logger.info('Put tender {} back to tenders queue'.format(tender_to_sync['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, params={"TENDER_ID": tender_to_sync['id']}))
-            self.tenders_queue.put(tender_to_sync)
+            self.tenders_queue.put(tender_to_sync, lane=lane)
             gevent.sleep(self.on_error_delay)
         else:
             if 'contracts' not in tender:
                 logger.warn('!!!No contracts found in tender {}'.format(tender['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, params={"TENDER_ID": tender['id']}))
                 return
+            active_contracts_ids = [contract['id'] for contract in tender['contracts']
+                                    if contract["status"] == "active"]
+            cached_contracts = dict(zip(active_contracts_ids,
+                                        self.cache_db.has_many(active_contracts_ids)))
+            for contract_id in active_contracts_ids:
+                self.pending_contracts.add(contract_id, tender_to_sync['id'], tender_to_sync['dateModified'])
+            # contracts found in contracting api are cached in one batch
+            existing_contracts = []
             for contract in tender['contracts']:
                 if contract["status"] == "active":
 
-                    self.basket[contract['id']] = tender_to_sync['dateModified']
                     try:
-                        if not self.cache_db.has(contract['id']):
-                            self.contracting_client_ro.get_contract(contract['id'])
+                        if not cached_contracts[contract['id']]:
+                            if self.contracts_index and self.contracts_index_covers(tender_to_sync['dateModified']):
+                                self.metrics.inc('contract_lookups_skipped_total')
+                                raise ResourceNotFound()
+                            with self.rate_limits['contracting_read'], self.breakers['contracting_read'], \
+                                    self.metrics.timer('request_duration_seconds', call='get_contract'):
+                                self.contracting_client_ro.get_contract(contract['id'])
                         else:
-                            logger.info('Contract {} exists in local db'.format(contract['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_CACHED}, params={"CONTRACT_ID": contract['id']}))
+                            log_event(logging.INFO, DATABRIDGE_CACHED, {"CONTRACT_ID": contract['id']},
+                                      'Contract %s exists in local db', contract['id'])
                             self._put_tender_in_cache_by_contract(contract, tender_to_sync['id'])
                             continue
                     except ResourceNotFound:
-                        logger.info('Sync contract {} of tender {}'.format(contract['id'], tender['id']), extra=journal_context(
-                            {"MESSAGE_ID": DATABRIDGE_CONTRACT_TO_SYNC}, {"CONTRACT_ID": contract['id'], "TENDER_ID": tender['id']}))
+                        log_event(logging.INFO, DATABRIDGE_CONTRACT_TO_SYNC, {"CONTRACT_ID": contract['id'], "TENDER_ID": tender['id']},
+                                  'Sync contract %s of tender %s', contract['id'], tender['id'])
                     except ResourceGone:
                         logger.info(
                             'Sync contract {} of tender {} has been '
@@ -277,6 +791,7 @@ class ContractingDataBridge(object):
                                 {"MESSAGE_ID": DATABRIDGE_CONTRACT_TO_SYNC},
                                 {"CONTRACT_ID": contract['id'],
                                  "TENDER_ID": tender['id']}))
+                        self._put_tender_in_cache_by_contract(contract, tender_to_sync['id'])
                         continue
                     except Exception, e:
                         logger.warn('Fail to contract existance {}'.format(contract['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, params={"TENDER_ID": tender_to_sync['id'],
@@ -284,12 +799,13 @@ class ContractingDataBridge(object):
                         logger.exception(e)
                         logger.info('Put tender {} back to tenders queue'.format(tender_to_sync['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, params={"TENDER_ID": tender_to_sync['id'],
                                                                                                                                                                             "CONTRACT_ID": contract['id']}))
-                        self.tenders_queue.put(tender_to_sync)
+                        self.tenders_queue.put(tender_to_sync, lane=lane)
+                        self.cache_db.put_many(existing_contracts)
                         raise
                     else:
-                        self.cache_db.put(contract['id'], True)
-                        logger.info('Contract exists {}'.format(contract['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_CONTRACT_EXISTS},
-                                                                                                       {"TENDER_ID": tender_to_sync['id'], "CONTRACT_ID": contract['id']}))
+                        existing_contracts.append((contract['id'], True))
+                        log_event(logging.INFO, DATABRIDGE_CONTRACT_EXISTS, {"TENDER_ID": tender_to_sync['id'], "CONTRACT_ID": contract['id']},
+                                  'Contract exists %s', contract['id'])
                         self._put_tender_in_cache_by_contract(contract, tender_to_sync['id'])
                         continue
 
@@ -299,24 +815,24 @@ class ContractingDataBridge(object):
                         contract['mode'] = tender['mode']
 
                     if not contract.get('items'):
-                        logger.info('Copying contract {} items'.format(contract['id']), extra=journal_context({"MESSAGE_ID": DATABRIDGE_COPY_CONTRACT_ITEMS},
-                                                                                                              {"CONTRACT_ID": contract['id'], "TENDER_ID": tender_to_sync['id']}))
+                        log_event(logging.INFO, DATABRIDGE_COPY_CONTRACT_ITEMS, {"CONTRACT_ID": contract['id'], "TENDER_ID": tender_to_sync['id']},
+                                  'Copying contract %s items', contract['id'])
                         if tender.get('lots'):
                             related_awards = [aw for aw in tender['awards'] if aw['id'] == contract['awardID']]
                             if related_awards:
                                 award = related_awards[0]
                                 if award.get("items"):
-                                    logger.debug('Copying items from related award {}'.format(award['id']))
+                                    log_event(logging.DEBUG, None, None, 'Copying items from related award %s', award['id'])
                                     contract['items'] = award['items']
                                 else:
-                                    logger.debug('Copying items matching related lot {}'.format(award['lotID']))
+                                    log_event(logging.DEBUG, None, None, 'Copying items matching related lot %s', award['lotID'])
                                     contract['items'] = [item for item in tender['items'] if item.get('relatedLot') == award['lotID']]
                             else:
                                 logger.warn('Not found related award for contact {} of tender {}'.format(contract['id'], tender['id']),
                                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, params={"CONTRACT_ID": contract['id'], "TENDER_ID": tender['id']}))
                         else:
-                            logger.debug('Copying all tender {} items into contract {}'.format(tender['id'], contract['id']),
-                                         extra=journal_context({"MESSAGE_ID": DATABRIDGE_COPY_CONTRACT_ITEMS}, params={"CONTRACT_ID": contract['id'], "TENDER_ID": tender['id']}))
+                            log_event(logging.DEBUG, DATABRIDGE_COPY_CONTRACT_ITEMS, {"CONTRACT_ID": contract['id'], "TENDER_ID": tender['id']},
+                                      'Copying all tender %s items into contract %s', tender['id'], contract['id'])
                             contract['items'] = tender['items']
 
                     if isinstance(contract.get('items', None), list) and len(contract.get('items')) == 0:
@@ -339,6 +855,8 @@ class ContractingDataBridge(object):
                                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, params={"CONTRACT_ID": contract['id'], "TENDER_ID": tender['id']}))
 
                     self.handicap_contracts_queue.put(contract)
+            self.cache_db.put_many(existing_contracts)
+            self.metrics.inc('tenders_processed_total')
 
     def get_tender_contracts(self):
         while True:
@@ -351,138 +869,221 @@ class ContractingDataBridge(object):
                 raise
             gevent.sleep(0)
 
-    def prepare_contract_data(self):
-        unsuccessful_contracts = set()
-        unsuccessful_contracts_limit = 10
+    def _iter_queue(self, queue, breaker=None):
         while INFINITY_LOOP:
-            contract = self.handicap_contracts_queue.get()
-            try:
-                logger.info("Getting extra info for tender {}".format(contract['tender_id']),
-                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_GET_EXTRA_INFO}, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
-                tender_data = self.get_tender_credentials(contract['tender_id'])
-                assert 'owner' in tender_data.data
-                assert 'tender_token' in tender_data.data
-                unsuccessful_contracts.clear()
-            except Exception, e:
+            # stage is paused while its upstream is down
+            if breaker is not None:
+                breaker.wait()
+            yield queue.get()
+
+    def _get_contract_credentials(self, contract):
+        log_event(logging.INFO, DATABRIDGE_GET_EXTRA_INFO, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']},
+                  "Getting extra info for tender %s", contract['tender_id'])
+        try:
+            return contract, self.get_tender_credentials_shared(contract['tender_id']), None
+        except Exception, e:
+            return contract, None, e
+
+    def prepare_contract_data(self):
+        for contract, tender_data, e in imap_ordered(self._get_contract_credentials,
+                                                     self._iter_queue(self.handicap_contracts_queue,
+                                                                      self.breakers['tenders_credentials']),
+                                                     self.credentials_workers_count):
+            if e is not None:
                 logger.warn("Can't get tender credentials {}".format(contract['tender_id']),
                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
                 logger.exception(e)
                 self.handicap_contracts_queue_retry.put(contract)
-                unsuccessful_contracts.add(contract['id'])
-                if len(unsuccessful_contracts) >= unsuccessful_contracts_limit:
-                    # Current server stopped processing requests, reconnecting to other
-                    logger.info("Reconnecting tenders client",
-                                extra=journal_context({"MESSAGE_ID": DATABRIDGE_RECONNECT},
-                                                      {"CONTRACT_ID": contract['id'],
-                                                       "TENDER_ID": contract['tender_id']}))
-                    self.client = TendersClient(self.config_get('api_token'),
-                        host_url=self.api_server, api_version=self.api_version)
-                    unsuccessful_contracts.clear()
-                gevent.sleep(self.on_error_delay)
             else:
-                logger.debug("Got extra info for tender {}".format(contract['tender_id']),
-                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_GOT_EXTRA_INFO}, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
+                log_event(logging.DEBUG, DATABRIDGE_GOT_EXTRA_INFO, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']},
+                          "Got extra info for tender %s", contract['tender_id'])
                 data = tender_data.data
                 contract['owner'] = data['owner']
                 contract['tender_token'] = data['tender_token']
                 self.contracts_put_queue.put(contract)
+            self.handicap_contracts_queue.ack(contract)
             gevent.sleep(0)
 
-    @retry(stop_max_attempt_number=7, wait_exponential_multiplier=1000 * 90)
-    def get_tender_data_with_retry(self, contract):
-        logger.info("Getting extra info for tender {}".format(contract['tender_id']),
-                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_GET_EXTRA_INFO},
-                                          {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
-        tender_data = self.get_tender_credentials(contract['tender_id'])
-        assert 'owner' in tender_data.data
-        assert 'tender_token' in tender_data.data
-        return tender_data
+    def dead_letters_init(self):
+        if self.cache_db._backend == 'redis':
+            return RedisJournal(self.cache_db.db, DEAD_LETTERS_KEY)
+        return FileJournal(os.path.join(self.config_get('queue_dir') or '.', DEAD_LETTERS_KEY + '.log'))
+
+    def add_dead_letter(self, queue_name, contract, error):
+        if self.dead_letters is None:
+            self.dead_letters = self.dead_letters_init()
+        self.dead_letters.add(self.dead_letters_name, {
+            'contract': contract, 'queue': queue_name,
+            'reason': '{}: {}'.format(type(error).__name__, error),
+            'attempts': self.retry_delays.max_attempts + 1, 'failed_at': time()})
+        self.metrics.inc('contracts_dead_lettered_total')
+
+    def _schedule_retry(self, queue_name, contract, error):
+        if self.retry_delays.schedule((queue_name, contract['id']), contract):
+            return
+        logger.warn("Can't sync contract {} of tender {}, attempts are exhausted".format(contract['id'], contract['tender_id']),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
+        self.pending_contracts.fail(contract['id'])
+        self.metrics.inc('contracts_failed_total')
+        self.add_dead_letter(queue_name, contract, error)
+        getattr(self, queue_name).ack(contract)
+
+    def retry_delayed_contracts(self):
+        while INFINITY_LOOP:
+            (queue_name, contract_id), contract = self.retry_delays.get()
+            queue = getattr(self, queue_name)
+            # the new delivery is journaled before the failed one is dropped
+            queue.put(contract)
+            queue.ack(contract)
 
     def prepare_contract_data_retry(self):
-        while INFINITY_LOOP:
-            contract = self.handicap_contracts_queue_retry.get()
+        for contract in self._iter_queue(self.handicap_contracts_queue_retry, self.breakers['tenders_credentials']):
+            log_event(logging.INFO, DATABRIDGE_GET_EXTRA_INFO, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']},
+                      "Getting extra info for tender %s", contract['tender_id'])
             try:
-                tender_data = self.get_tender_data_with_retry(contract)
+                tender_data = self.get_tender_credentials_shared(contract['tender_id'])
             except Exception, e:
                 logger.warn("Can't get tender credentials {}".format(contract['tender_id']),
                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION},
                                                   {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
                 logger.exception(e)
+                self._schedule_retry('handicap_contracts_queue_retry', contract, e)
             else:
-                logger.debug("Got extra info for tender {}".format(contract['tender_id']),
-                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_GOT_EXTRA_INFO},
-                                                   {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
+                self.retry_delays.done(('handicap_contracts_queue_retry', contract['id']))
+                log_event(logging.DEBUG, DATABRIDGE_GOT_EXTRA_INFO, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']},
+                          "Got extra info for tender %s", contract['tender_id'])
                 data = tender_data.data
                 contract['owner'] = data['owner']
                 contract['tender_token'] = data['tender_token']
                 self.contracts_put_queue.put(contract)
+                self.handicap_contracts_queue_retry.ack(contract)
             gevent.sleep(0)
 
-    def put_contracts(self):
-        unsuccessful_contracts = set()
-        unsuccessful_contracts_limit = 10
-        while INFINITY_LOOP:
-            contract = self.contracts_put_queue.get()
-            try:
-                logger.info("Creating contract {} of tender {}".format(contract['id'], contract['tender_id']),
-                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_CREATE_CONTRACT}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
-                data = {"data": contract.toDict()}
+    def _create_contract(self, contract):
+        try:
+            log_event(logging.INFO, DATABRIDGE_CREATE_CONTRACT, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']},
+                      "Creating contract %s of tender %s", contract['id'], contract['tender_id'])
+            data = {"data": contract.toDict()}
+            with self.rate_limits['contracting_write'], self.breakers['contracting_write'], \
+                    self.metrics.timer('request_duration_seconds', call='create_contract'):
                 self.contracting_client.create_contract(data)
-                unsuccessful_contracts.clear()
-                logger.info("Successfully created contract {} of tender {}".format(contract['id'], contract['tender_id']),
-                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_CONTRACT_CREATED}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
-            except Exception, e:
+        except Exception, e:
+            return contract, e
+        return contract, None
+
+    def _contract_exists(self, contract):
+        # contract was created since it was looked up or its lookup was
+        # skipped while the contracts index had not reached it yet
+        log_event(logging.INFO, DATABRIDGE_CONTRACT_EXISTS, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']},
+                  "Contract %s of tender %s exists in contracting API", contract['id'], contract['tender_id'])
+        self.metrics.inc('contract_create_conflicts_total')
+        self.cache_db.put(contract['id'], True)
+        self._put_tender_in_cache_by_contract(contract, contract['tender_id'])
+
+    def put_contracts(self):
+        for contract, e in imap_ordered(self._create_contract,
+                                        self._iter_queue(self.contracts_put_queue, self.breakers['contracting_write']),
+                                        self.put_contracts_workers_count):
+            if e is not None and is_conflict(e):
+                self._contract_exists(contract)
+            elif e is not None:
                 logger.info("Unsuccessful put for contract {0} of tender {1}".format(contract['id'], contract['tender_id']),
                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
                 logger.exception(e)
+                self.metrics.inc('contract_create_errors_total')
                 logger.info("Schedule retry for contract {0}".format(contract['id']),
                             extra=journal_context({"MESSAGE_ID": DATABRIDGE_RETRY_CREATE}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
                 self.contracts_retry_put_queue.put(contract)
-                unsuccessful_contracts.add(contract['id'])
-                if len(unsuccessful_contracts) >= unsuccessful_contracts_limit:
-                    # Current server stopped processing requests, reconnecting to other
-                    logger.info("Reconnecting contract client",
-                                extra=journal_context({"MESSAGE_ID": DATABRIDGE_RECONNECT}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
-                    self.contracting_client_init()
-                    unsuccessful_contracts.clear()
             else:
+                log_event(logging.INFO, DATABRIDGE_CONTRACT_CREATED, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']},
+                          "Successfully created contract %s of tender %s", contract['id'], contract['tender_id'])
+                self.metrics.inc('contracts_created_total')
                 self.cache_db.put(contract['id'], True)
                 self._put_tender_in_cache_by_contract(contract, contract['tender_id'])
+            self.contracts_put_queue.ack(contract)
+            gevent.sleep(0)
 
+    def retry_put_contracts(self):
+        for contract in self._iter_queue(self.contracts_retry_put_queue, self.breakers['contracting_write']):
+            contract, e = self._create_contract(contract)
+            if e is not None and not is_conflict(e):
+                logger.exception(e)
+                self.metrics.inc('contract_create_errors_total')
+                self._schedule_retry('contracts_retry_put_queue', contract, e)
+            else:
+                self.retry_delays.done(('contracts_retry_put_queue', contract['id']))
+                if e is not None:
+                    self._contract_exists(contract)
+                else:
+                    log_event(logging.INFO, DATABRIDGE_CONTRACT_CREATED, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']},
+                              "Successfully created contract %s of tender %s", contract['id'], contract['tender_id'])
+                    self.metrics.inc('contracts_created_total')
+                    self.cache_db.put(contract['id'], True)
+                    self._put_tender_in_cache_by_contract(contract, contract['tender_id'])
+                self.contracts_retry_put_queue.ack(contract)
             gevent.sleep(0)
 
-    @retry(stop_max_attempt_number=15, wait_exponential_multiplier=1000 * 60)
-    def _put_with_retry(self, contract):
+    def _replay_dead_letter(self, entry):
+        key, lane, letter = entry
+        contract = munchify(letter['contract'])
         try:
-            data = {"data": contract.toDict()}
-            logger.info("Creating contract {} of tender {}".format(contract['id'], contract['tender_id']),
-                        extra=journal_context({"MESSAGE_ID": DATABRIDGE_CREATE_CONTRACT}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
-            self.contracting_client.create_contract(data)
-        except Exception, e:
-            logger.exception(e)
-            raise
-
-    def retry_put_contracts(self):
-        while INFINITY_LOOP:
             try:
-                contract = self.contracts_retry_put_queue.get()
-                self._put_with_retry(contract)
-                logger.info("Successfully created contract {} of tender {}".format(contract['id'], contract['tender_id']),
-                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_CONTRACT_CREATED}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
-            except:
-                logger.warn("Can't create contract {}".format(contract['id']),  extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {"TENDER_ID": contract['tender_id'], "CONTRACT_ID": contract['id']}))
+                with self.rate_limits['contracting_read']:
+                    self.contracting_client.get_contract(contract['id'])
+            except ResourceNotFound:
+                pass
             else:
-                self.cache_db.put(contract['id'], True)
-                self._put_tender_in_cache_by_contract(contract, contract['tender_id'])
-            gevent.sleep(0)
+                return entry, None  # created since it failed
+            if letter['queue'] == 'handicap_contracts_queue_retry':
+                data = self.get_tender_credentials_shared(contract['tender_id']).data
+                contract['owner'] = data['owner']
+                contract['tender_token'] = data['tender_token']
+            contract, e = self._create_contract(contract)
+            if e is not None and not is_conflict(e):
+                raise e
+        except Exception, e:
+            return entry, e
+        self.cache_db.put(contract['id'], True)
+        return entry, None
+
+    def replay_dead_letters(self, concurrency=10, rate=None, workers_count=1):
+        """ Create dead letter contracts again, return numbers of replayed and failed ones """
+        self.dead_letters = self.dead_letters_init()
+        names = [self.dead_letters_name]
+        if workers_count > 1:
+            names.extend('{}_{}'.format(self.dead_letters_name, number) for number in xrange(workers_count))
+        replayed = failed = 0
+        for name in names:
+            for (key, lane, letter), e in imap_ordered(self._replay_dead_letter,
+                                                       paced(self.dead_letters.load(name), rate),
+                                                       concurrency):
+                contract = letter['contract']
+                self.dead_letters.remove(name, key)
+                if e is None:
+                    replayed += 1
+                    logger.info("Replayed contract {} of tender {}".format(contract['id'], contract['tender_id']),
+                                extra=journal_context({"MESSAGE_ID": DATABRIDGE_CONTRACT_CREATED}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
+                else:
+                    failed += 1
+                    logger.warn("Can't replay contract {} of tender {}".format(contract['id'], contract['tender_id']),
+                                extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {"CONTRACT_ID": contract['id'], "TENDER_ID": contract['tender_id']}))
+                    logger.exception(e)
+                    letter.update(reason='{}: {}'.format(type(e).__name__, e),
+                                  attempts=letter['attempts'] + 1, failed_at=time())
+                    self.dead_letters.add(name, letter)
+        self.dead_letters.close()
+        logger.info("Replayed {} dead letter contracts, {} failed again".format(replayed, failed),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+        return replayed, failed
 
     def get_tender_contracts_forward(self):
         logger.info('Start forward data sync worker...')
-        params = {'opt_fields': 'status,lots,procurementMethodType', 'mode': '_all_'}
+        params = {'opt_fields': self.tender_filter.opt_fields, 'mode': '_all_',
+                  'limit': self.feed_page_size}
         try:
             for tender_data in self.get_tenders(params=params, direction="forward"):
-                logger.info('Forward sync: Put tender {} to process...'.format(tender_data['id']),
-                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_TENDER_PROCESS}, {"TENDER_ID": tender_data['id']}))
+                log_event(logging.INFO, DATABRIDGE_TENDER_PROCESS, {"TENDER_ID": tender_data['id']},
+                          'Forward sync: Put tender %s to process...', tender_data['id'])
                 self.tenders_queue.put(tender_data)
         except Exception, e:
             # TODO reset queues and restart sync
@@ -494,17 +1095,21 @@ class ContractingDataBridge(object):
 
     def get_tender_contracts_backward(self):
         logger.info('Start backward data sync worker...')
-        params = {'opt_fields': 'status,lots,procurementMethodType', 'descending': 1, 'mode': '_all_'}
+        params = {'opt_fields': self.tender_filter.opt_fields, 'descending': 1, 'mode': '_all_',
+                  'limit': self.feed_page_size}
         try:
             for tender_data in self.get_tenders(params=params, direction="backward"):
                 stored = self.cache_db.get(tender_data['id'])
                 if stored and stored == tender_data['dateModified']:
-                    logger.info('Tender {} not modified from last check. Skipping'.format(tender_data['id']), extra=journal_context(
-                        {"MESSAGE_ID": DATABRIDGE_SKIP_NOT_MODIFIED}, {"TENDER_ID": tender_data['id']}))
+                    self.metrics.inc('tenders_skipped_total', reason='not_modified')
+                    self.skip_summaries['backward'].add('not_modified', tender_data['id'])
+                    if self.log_skipped_tenders:
+                        logger.info('Tender {} not modified from last check. Skipping'.format(tender_data['id']), extra=journal_context(
+                            {"MESSAGE_ID": DATABRIDGE_SKIP_NOT_MODIFIED}, {"TENDER_ID": tender_data['id']}))
                     continue
-                logger.info('Backward sync: Put tender {} to process...'.format(tender_data['id']),
-                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_TENDER_PROCESS}, {"TENDER_ID": tender_data['id']}))
-                self.tenders_queue.put(tender_data)
+                log_event(logging.INFO, DATABRIDGE_TENDER_PROCESS, {"TENDER_ID": tender_data['id']},
+                          'Backward sync: Put tender %s to process...', tender_data['id'])
+                self.tenders_queue.put(tender_data, lane=BACKLOG_LANE)
         except Exception, e:
             # TODO reset queues and restart sync
             logger.warn('Backward worker died!', extra=journal_context({"MESSAGE_ID": DATABRIDGE_WORKER_DIED}, {}))
@@ -513,11 +1118,18 @@ class ContractingDataBridge(object):
         else:
             logger.info('Backward data sync finished.')
 
-    def sync_single_tender(self, tender_id):
+    def sync_single_tender(self, tender_id, summary=None):
+        """ Create missing active contracts of tender
+
+        Ids of created and existing contracts are added to `created` and
+        `existing` lists of `summary` and a failure to its `failed` list.
+        """
         transfered_contracts = []
+        contract_id = None
         try:
             logger.info("Getting tender {}".format(tender_id))
-            tender = self.tenders_sync_client.get_tender(tender_id)['data']
+            with self.rate_limits['tenders_read']:
+                tender = self.tenders_sync_client.get_tender(tender_id)['data']
             logger.info("Got tender {} in status {}".format(tender['id'], tender['status']))
 
             logger.info("Getting tender {} credentials".format(tender_id))
@@ -528,14 +1140,18 @@ class ContractingDataBridge(object):
                 if contract['status'] != 'active':
                     logger.info("Skip contract {} in status {}".format(contract['id'], contract['status']))
                     continue
+                contract_id = contract['id']
 
                 logger.info("Checking if contract {} already exists".format(contract['id']))
                 try:
-                    self.contracting_client.get_contract(contract['id'])
+                    with self.rate_limits['contracting_read']:
+                        self.contracting_client.get_contract(contract['id'])
                 except ResourceNotFound:
                     logger.info('Contract {} does not exists. Prepare contract for creation.'.format(contract['id']))
                 else:
                     logger.info('Contract exists {}'.format(contract['id']))
+                    if summary is not None:
+                        summary['existing'].append(contract['id'])
                     continue
 
                 logger.info("Extending contract {} with extra data".format(contract['id']))
@@ -547,12 +1163,18 @@ class ContractingDataBridge(object):
                 contract['tender_token'] = tender_credentials['tender_token']
                 data = {"data": contract.toDict()}
                 logger.info("Creating contract {}".format(contract['id']))
-                response = self.contracting_client.create_contract(data)
+                with self.rate_limits['contracting_write']:
+                    response = self.contracting_client.create_contract(data)
                 assert 'data' in response
                 logger.info("Contract {} created".format(contract['id']))
                 transfered_contracts.append(contract['id'])
+                if summary is not None:
+                    summary['created'].append(contract['id'])
         except Exception, e:
             logger.exception(e)
+            if summary is not None:
+                summary['failed'].append({'tender_id': tender_id, 'contract_id': contract_id,
+                                          'error': '{}: {}'.format(type(e).__name__, e)})
             raise
         else:
             if transfered_contracts:
@@ -560,9 +1182,27 @@ class ContractingDataBridge(object):
             else:
                 logger.info("Tender {} does not contain contracts to transfer".format(tender_id))
 
+    def _sync_tender_of_batch(self, tender_id, summary):
+        try:
+            self.sync_single_tender(tender_id, summary)
+        except Exception:
+            pass  # already in the summary
+
+    def sync_tenders(self, tender_ids, concurrency=10):
+        """ Sync contracts of many tenders at once, return summary of created, existing and failed ones """
+        summary = {'tenders': 0, 'created': [], 'existing': [], 'failed': []}
+        for result in imap_ordered(lambda tender_id: self._sync_tender_of_batch(tender_id, summary),
+                                   tender_ids, concurrency):
+            summary['tenders'] += 1
+        logger.info("Synced {} tenders: {} contracts created, {} existed, {} failures".format(
+                    summary['tenders'], len(summary['created']), len(summary['existing']), len(summary['failed'])),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+        return summary
 
     def _start_synchronization_workers(self):
         logger.info('Starting forward and backward sync workers')
+        # backward worker may set the event before forward worker starts
+        self.initialization_event.clear()
         self.jobs = [gevent.spawn(self.get_tender_contracts_backward),
                      gevent.spawn(self.get_tender_contracts_forward)]
 
@@ -573,57 +1213,151 @@ class ContractingDataBridge(object):
         self.clients_initialize()
         self._start_synchronization_workers()
 
+    def _spawn_immortal_job(self, name):
+        # extra workers of the same stage are named '<stage>:<number>'
+        return gevent.spawn(getattr(self, name.split(':')[0]))
+
     def _start_contract_sculptors(self):
         self.immortal_jobs = {'get_tender_contracts': gevent.spawn(self.get_tender_contracts),
                               'prepare_contract_data': gevent.spawn(self.prepare_contract_data),
                               'prepare_contract_data_retry': gevent.spawn(self.prepare_contract_data_retry),
                               'put_contracts': gevent.spawn(self.put_contracts),
-                              'retry_put_contracts': gevent.spawn(self.retry_put_contracts)}
+                              'retry_put_contracts': gevent.spawn(self.retry_put_contracts),
+                              'retry_delayed_contracts': gevent.spawn(self.retry_delayed_contracts)}
+        for number in xrange(1, self.tenders_workers_count):
+            name = 'get_tender_contracts:{}'.format(number)
+            self.immortal_jobs[name] = self._spawn_immortal_job(name)
+        if self.contracts_index:
+            self.immortal_jobs['sync_contracts_index'] = self._spawn_immortal_job('sync_contracts_index')
+
+    def _log_state(self):
+        logger.info(
+            'Current state: Tenders to process {}; Unhandled '
+            'contracts {}; Contracts to create {}; Retrying to '
+            'create {}'.format(
+                self.tenders_queue.qsize(),
+                self.handicap_contracts_queue.qsize(),
+                self.contracts_put_queue.qsize(),
+                self.contracts_retry_put_queue.qsize()),
+            extra={
+                'tenders_queue_size': self.tenders_queue.qsize(),
+                'handicap_contracts_queue_size':
+                    self.handicap_contracts_queue.qsize(),
+                'contracts_queue_size':
+                    self.contracts_put_queue.qsize(),
+                'contracts_retry_queue':
+                    self.contracts_retry_put_queue.qsize()})
+        if self.cache_db.front_cache is not None:
+            logger.info(
+                'Cache front layer: hits {}; misses {}; '
+                'size {}'.format(
+                    self.cache_db.front_cache.hits,
+                    self.cache_db.front_cache.misses,
+                    len(self.cache_db.front_cache)),
+                extra={
+                    'cache_front_hits': self.cache_db.front_cache.hits,
+                    'cache_front_misses': self.cache_db.front_cache.misses,
+                    'cache_front_size': len(self.cache_db.front_cache)})
+        if self.http_adapter is not None:
+            self.http_adapter.close_idle()
+            stats = self.http_adapter.stats()
+            logger.info(
+                'HTTP connections: hosts {hosts}; opened {connections_opened}; '
+                'reused {connections_reused}; requests {requests}'.format(**stats),
+                extra=dict(('http_' + name, value) for name, value in stats.items()))
+        self.pending_contracts.expire()
+        logger.info(
+            'Pending contracts: {} of {} tenders; oldest age {:.0f}s; '
+            'evicted {}; expired {}; failed {}'.format(
+                len(self.pending_contracts),
+                self.pending_contracts.tenders_count,
+                self.pending_contracts.oldest_age(),
+                self.pending_contracts.evicted,
+                self.pending_contracts.expired,
+                self.pending_contracts.failed),
+            extra={
+                'pending_contracts': len(self.pending_contracts),
+                'pending_tenders': self.pending_contracts.tenders_count,
+                'pending_oldest_age': self.pending_contracts.oldest_age(),
+                'pending_evicted': self.pending_contracts.evicted,
+                'pending_expired': self.pending_contracts.expired,
+                'pending_failed': self.pending_contracts.failed})
+        if self.persist_pending_contracts:
+            self.save_pending_contracts()
+
+    def _check_synchronization_workers(self):
+        backward_worker, forward_worker = self.jobs
+        if forward_worker.dead or (backward_worker.dead and not backward_worker.successful()):
+            self._restart_synchronization_workers()
+
+    def _check_immortal_jobs(self):
+        for name, job in self.immortal_jobs.items():
+            if job.dead:
+                logger.warn('Restarting {} worker'.format(name))
+                if name.startswith('get_tender_contracts'):
+                    self.contracting_client_init()
+                self.immortal_jobs[name] = self._spawn_immortal_job(name)
+
+    def stop(self):
+        """ Stop reading the tenders feed and exit once the pipeline is drained """
+        if self.stopping_at is not None:
+            return
+        logger.info('Stopping, draining queues for up to {}s'.format(self.drain_timeout),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+        self.stopping_at = time()
+        for job in self.jobs:
+            job.kill(block=False)
+        if self.sync_point:
+            self.save_sync_point(force=True)
+
+    def _drained(self):
+        return (not len(self.pending_contracts) and not len(self.tenders_locks) and not len(self.retry_delays) and
+                all(getattr(self, name).qsize() == 0 for name in QUEUE_NAMES))
 
     def run(self):
         logger.info('Start Contracting Data Bridge', extra=journal_context({"MESSAGE_ID": DATABRIDGE_START}, {}))
+        gevent.signal(signal.SIGTERM, self.stop)
+        if self.metrics_port:
+            self.metrics_server = self.metrics.serve(self.metrics_host, self.metrics_port)
+            logger.info('Serving metrics on {}:{}'.format(self.metrics_host, self.metrics_port),
+                        extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
         self._start_contract_sculptors()
+        if self.persist_pending_contracts and len(self.pending_contracts):
+            # tenders of contracts left from the previous run are synced again
+            gevent.spawn(self.requeue_pending_tenders)
         self._start_synchronization_workers()
-        backward_worker, forward_worker = self.jobs
         counter = 0
 
         try:
             while INFINITY_LOOP:
-                gevent.sleep(self.jobs_watcher_delay)
+                # drain is checked more often than workers
+                gevent.sleep(self.jobs_watcher_delay if self.stopping_at is None else 1)
                 if counter == 20:
-                    logger.info(
-                        'Current state: Tenders to process {}; Unhandled '
-                        'contracts {}; Contracts to create {}; Retrying to '
-                        'create {}'.format(
-                            self.tenders_queue.qsize(),
-                            self.handicap_contracts_queue.qsize(),
-                            self.contracts_put_queue.qsize(),
-                            self.contracts_retry_put_queue.qsize()),
-                        extra={
-                            'tenders_queue_size': self.tenders_queue.qsize(),
-                            'handicap_contracts_queue_size':
-                                self.handicap_contracts_queue.qsize(),
-                            'contracts_queue_size':
-                                self.contracts_put_queue.qsize(),
-                            'contracts_retry_queue':
-                                self.contracts_retry_put_queue.qsize()})
+                    self._log_state()
                     counter = 0
                 counter += 1
-                if forward_worker.dead or (backward_worker.dead and not backward_worker.successful()):
-                    self._restart_synchronization_workers()
-                    backward_worker, forward_worker = self.jobs
-
-                for name, job in self.immortal_jobs.items():
-                    if job.dead:
-                        logger.warn('Restarting {} worker'.format(name))
-                        if name == 'get_tender_contracts':
-                            self.contracting_client_init()
-                        self.immortal_jobs[name] = gevent.spawn(getattr(self, name))
+                if self.stopping_at is None:
+                    self._check_synchronization_workers()
+                elif self._drained() or time() - self.stopping_at >= self.drain_timeout:
+                    logger.info('Pipeline is {}drained'.format('' if self._drained() else 'not '),
+                                extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+                    raise KeyboardInterrupt  # exit the same way as on interruption
+                self._check_immortal_jobs()
 
         except KeyboardInterrupt:
             logger.info('Exiting...')
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+            if self.persist_pending_contracts:
+                self.save_pending_contracts()
             gevent.killall(self.jobs, timeout=5)
-            gevent.killall(self.immortal_jobs, timeout=5)
+            gevent.killall(self.immortal_jobs.values(), timeout=5)
+            if self.sync_point:
+                self.save_sync_point(force=True, drained=self._drained())
+            if self.queues_journal is not None:
+                self.queues_journal.close()
+            if self.dead_letters is not None:
+                self.dead_letters.close()
         except Exception, e:
             logger.exception(e)
 
@@ -632,13 +1366,53 @@ def main():
     parser = argparse.ArgumentParser(description='Contracting Data Bridge')
     parser.add_argument('config', type=str, help='Path to configuration file')
     parser.add_argument('--tender', type=str, help='Tender id to sync', dest="tender_id")
+    parser.add_argument('--tenders-file', type=str, dest='tenders_file',
+                        help="Sync tenders with ids from file, one per line, '-' for stdin, "
+                             "and print JSON summary")
+    parser.add_argument('--sync-concurrency', type=int, default=10, dest='sync_concurrency',
+                        help='Number of tenders of --tenders-file synced at once')
+    parser.add_argument('--full-sync', action='store_true', dest='full_sync',
+                        help='Ignore saved sync point and sync all tenders from the top of the feed')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes that sync contracts of the feed tenders')
+    parser.add_argument('--worker-number', type=int, dest='worker_number', help=argparse.SUPPRESS)
+    parser.add_argument('--replay-dead-letters', action='store_true', dest='replay_dead_letters',
+                        help='Create contracts that ran out of attempts again and exit; '
+                             'without redis cache run it while the bridge is stopped')
+    parser.add_argument('--replay-concurrency', type=int, default=10, dest='replay_concurrency',
+                        help='Number of contracts replayed at once')
+    parser.add_argument('--replay-rate', type=float, dest='replay_rate',
+                        help='Max number of contracts replayed per second')
     params = parser.parse_args()
     if os.path.isfile(params.config):
         with open(params.config) as config_file_obj:
             config = load(config_file_obj.read())
         logging.config.dictConfig(config)
+        if params.full_sync:
+            config['main']['full_backward_sync'] = True
         if params.tender_id:
             ContractingDataBridge(config).sync_single_tender(params.tender_id)
+        elif params.tenders_file:
+            if params.tenders_file == '-':
+                tenders_file = FileObject(sys.stdin.fileno(), 'rb', close=False)
+            else:
+                tenders_file = open(params.tenders_file)
+            tender_ids = read_tender_ids(iter(tenders_file.readline, ''))
+            try:
+                summary = ContractingDataBridge(config).sync_tenders(tender_ids, params.sync_concurrency)
+            finally:
+                tenders_file.close()
+            print json.dumps(summary)
+            sys.exit(1 if summary['failed'] else 0)
+        elif params.replay_dead_letters:
+            ContractingDataBridge(config).replay_dead_letters(params.replay_concurrency, params.replay_rate,
+                                                              params.workers)
+        elif params.worker_number is not None:
+            from openprocurement.bridge.contracting.multiprocess import WorkerBridge
+            WorkerBridge(config, params.worker_number).run()
+        elif params.workers > 1:
+            from openprocurement.bridge.contracting.multiprocess import FeedBridge
+            FeedBridge(config, os.path.abspath(params.config), params.workers).run()
         else:
             ContractingDataBridge(config).run()
     else:
@@ -16,6 +16,7 @@ DATABRIDGE_CONTRACT_CREATED = "c_bridge_contract_created"
 DATABRIDGE_RETRY_CREATE = "c_bridge_create_retry"
 DATABRIDGE_TENDER_PROCESS = "c_bridge_tender_process"
 DATABRIDGE_SKIP_NOT_MODIFIED = "c_bridge_not_modified"
+DATABRIDGE_SKIP_SUMMARY = "c_bridge_skip_summary"
 DATABRIDGE_SYNC_SLEEP = "c_bridge_sleep"
 DATABRIDGE_SYNC_RESUME = "c_bridge_resume"
 DATABRIDGE_WORKER_DIED = "c_bridge_worker_died"
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import time
+
+from gevent.pywsgi import WSGIServer
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels, **extra):
+    labels = labels + tuple(sorted(extra.items()))
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, v) for k, v in labels) + '}'
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        """ Estimate quantile by linear interpolation inside its bucket """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower, lower_count = 0.0, 0
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                if count == lower_count:
+                    return bound
+                return lower + (bound - lower) * (rank - lower_count) / (count - lower_count)
+            lower, lower_count = bound, count
+        return self.buckets[-1]
+
+
+class Metrics(object):
+    """ Counters, gauges and histograms in Prometheus text format """
+
+    def __init__(self, prefix='contracting_databridge'):
+        self.prefix = prefix
+        self.counters = OrderedDict()
+        self.gauges = OrderedDict()
+        self.histograms = OrderedDict()
+
+    def _key(self, name, labels):
+        return '{}_{}'.format(self.prefix, name), tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, func, **labels):
+        """ Register callable that returns the current gauge value """
+        self.gauges[self._key(name, labels)] = func
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - start, **labels)
+
+    def get(self, name, **labels):
+        return self.counters.get(self._key(name, labels), 0)
+
+    def render(self):
+        lines = []
+        typed = set()
+
+        def add_type(name, metric_type):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+
+        for (name, labels), value in self.counters.items():
+            add_type(name, 'counter')
+            lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+        for (name, labels), func in self.gauges.items():
+            add_type(name, 'gauge')
+            lines.append('{}{} {}'.format(name, _format_labels(labels), func()))
+        for (name, labels), histogram in self.histograms.items():
+            add_type(name, 'histogram')
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, le=bound), count))
+            lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, le='+Inf'), histogram.count))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def wsgi_app(self, environ, start_response):
+        if environ.get('PATH_INFO') != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['Not Found\n']
+        body = self.render()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def serve(self, host, port):
+        server = WSGIServer((host, port), self.wsgi_app, log=None)
+        server.start()
+        return server
@@ -0,0 +1,247 @@
+import json
+import os
+import sys
+from zlib import crc32
+
+import gevent
+from gevent.fileobject import FileObject
+from gevent.subprocess import PIPE, Popen
+
+from openprocurement.bridge.contracting import databridge
+from openprocurement.bridge.contracting.databridge import (
+    BACKLOG_LANE, FRESH_LANE, ContractingDataBridge, PENDING_CONTRACTS_KEY, journal_context, logger
+)
+from openprocurement.bridge.contracting.journal_msg_ids import (
+    DATABRIDGE_EXCEPTION, DATABRIDGE_INFO
+)
+
+
+class FeedBridge(ContractingDataBridge):
+    """ Parent process of the multi-process bridge
+
+    Reads the tenders feed and dispatches tenders to worker processes by
+    tender id hash, so contracts of one tender are always handled by the
+    same worker. Messages are sent as JSON lines on the worker stdin and
+    worker state comes back as JSON lines on its stdout.
+
+    Dispatched tenders stay in flight until the worker reports them
+    released, and tenders in flight of a dead worker are dispatched again
+    to its replacement.
+    """
+
+    def __init__(self, config, config_path, workers_count):
+        super(FeedBridge, self).__init__(config)
+        self.config_path = config_path
+        self.workers_count = workers_count
+        self.workers = [None] * workers_count
+        self.workers_state = [{} for number in xrange(workers_count)]
+        self.workers_counters = [{} for number in xrange(workers_count)]
+        self.workers_index_checked_at = [None] * workers_count
+        # tenders dispatched to every worker by id, with sequence numbers of their messages
+        self.workers_in_flight = [{} for number in xrange(workers_count)]
+        self.dispatched = 0
+        # pending contracts are kept by worker processes
+        self.persist_pending_contracts = False
+        if self.cache_db._backend != 'redis':
+            logger.warn('Worker processes do not share {} cache backend, '
+                        'contracts index is disabled'.format(self.cache_db._backend),
+                        extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+            self.contracts_index = False
+        self.metrics.gauge('workers_alive', self.workers_alive)
+
+    def workers_alive(self):
+        return sum(1 for worker in self.workers if worker is not None and worker.poll() is None)
+
+    def worker_for(self, tender_id):
+        return (crc32(tender_id) & 0xffffffff) % self.workers_count
+
+    def _spawn_worker(self, number):
+        worker = self.workers[number] = Popen(
+            [sys.executable, '-c', 'from {} import main; main()'.format(databridge.__name__),
+             self.config_path, '--worker-number', str(number)],
+            stdin=PIPE, stdout=PIPE)
+        self.workers_index_checked_at[number] = None
+        gevent.spawn(self.read_worker_state, number, worker)
+        logger.info('Started worker process {} with pid {}'.format(number, worker.pid),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+
+    def read_worker_state(self, number, worker):
+        for line in iter(worker.stdout.readline, ''):
+            state = json.loads(line)
+            # tenders sent after the report was made are still in flight
+            received = state.pop('received', 0)
+            in_flight = self.workers_in_flight[number]
+            for tender_id in state.pop('released', ()):
+                if tender_id in in_flight and in_flight[tender_id][0] <= received:
+                    del in_flight[tender_id]
+            counters = self.workers_counters[number] = dict(
+                ((name, tuple(tuple(label) for label in labels)), value)
+                for name, labels, value in state.pop('counters'))
+            self.workers_state[number] = state
+            # worker counters are exposed as the sums over all workers
+            for key in counters:
+                self.metrics.counters[key] = sum(c.get(key, 0) for c in self.workers_counters)
+
+    def dispatch_tenders(self):
+        while databridge.INFINITY_LOOP:
+            lane, tender = self.tenders_queue.get_entry()
+            number = self.worker_for(tender['id'])
+            self.dispatched += 1
+            message = {'tender': tender, 'lane': lane, 'seq': self.dispatched}
+            if self.workers_index_checked_at[number] != self.contracts_index_checked_at:
+                message['contracts_index'] = {'state': self.contracts_index_state,
+                                              'checked_at': self.contracts_index_checked_at}
+            try:
+                self.workers[number].stdin.write(json.dumps(message) + '\n')
+                self.workers[number].stdin.flush()
+            except Exception, e:
+                logger.warn('Fail to dispatch tender {} to worker process {}'.format(tender['id'], number),
+                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {"TENDER_ID": tender['id']}))
+                logger.exception(e)
+                self.tenders_queue.put(tender, lane=lane)
+                gevent.sleep(self.on_error_delay)
+                raise
+            self.workers_in_flight[number][tender['id']] = (self.dispatched, tender)
+            self.tenders_queue.ack(tender)
+            self.workers_index_checked_at[number] = self.contracts_index_checked_at
+
+    def requeue_in_flight(self, number, in_flight):
+        """ Dispatch tenders in flight of a dead worker again """
+        logger.warn('Requeue {} tenders in flight of worker process {}'.format(len(in_flight), number),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {}))
+        for seq, tender in sorted(in_flight.values()):
+            self.tenders_queue.put(tender, lane=BACKLOG_LANE)
+
+    def _start_contract_sculptors(self):
+        for number in xrange(self.workers_count):
+            self._spawn_worker(number)
+        self.immortal_jobs = {'dispatch_tenders': gevent.spawn(self.dispatch_tenders)}
+        if self.contracts_index:
+            self.immortal_jobs['sync_contracts_index'] = self._spawn_immortal_job('sync_contracts_index')
+
+    def _check_immortal_jobs(self):
+        super(FeedBridge, self)._check_immortal_jobs()
+        for number, worker in enumerate(self.workers):
+            if worker.poll() is not None:
+                logger.warn('Worker process {} exited with code {}, restarting'.format(number, worker.returncode),
+                            extra=journal_context({"MESSAGE_ID": DATABRIDGE_EXCEPTION}, {}))
+                in_flight = self.workers_in_flight[number]
+                self.workers_in_flight[number] = {}
+                self._spawn_worker(number)
+                if in_flight:
+                    # tenders queue may be full until the dispatcher writes to the new worker
+                    gevent.spawn(self.requeue_in_flight, number, in_flight)
+
+    def _drained(self):
+        return super(FeedBridge, self)._drained() and not any(self.workers_in_flight)
+
+    def _log_state(self):
+        totals = dict((name, sum(state.get(name, 0) for state in self.workers_state))
+                      for name in ('tenders_queue', 'contracts_put_queue', 'pending_contracts'))
+        logger.info(
+            'Current state: Tenders to dispatch {}; Worker processes alive {} of {}; '
+            'Tenders to process {}; Contracts to create {}; Pending contracts {}; '
+            'Created contracts {}'.format(
+                self.tenders_queue.qsize(), self.workers_alive(), self.workers_count,
+                totals['tenders_queue'], totals['contracts_put_queue'],
+                totals['pending_contracts'], self.metrics.get('contracts_created_total')),
+            extra={'tenders_queue_size': self.tenders_queue.qsize(),
+                   'workers_alive': self.workers_alive(),
+                   'workers_tenders_queue_size': totals['tenders_queue'],
+                   'workers_contracts_queue_size': totals['contracts_put_queue'],
+                   'workers_pending_contracts': totals['pending_contracts']})
+
+    def run(self):
+        try:
+            super(FeedBridge, self).run()
+        finally:
+            # workers drain and exit on the end of their input
+            for worker in self.workers:
+                if worker is not None and worker.poll() is None:
+                    worker.stdin.close()
+            for worker in self.workers:
+                if worker is not None and worker.wait(timeout=self.drain_timeout + 10) is None:
+                    worker.kill()
+
+
+class WorkerBridge(ContractingDataBridge):
+    """ Worker process of the multi-process bridge
+
+    Syncs contracts of the tenders dispatched by the parent process. The
+    original stdout is kept for state reports and everything else printed
+    to stdout goes to stderr.
+    """
+
+    def __init__(self, config, worker_number):
+        self.worker_number = worker_number
+        self.input = FileObject(sys.stdin.fileno(), 'rb', close=False)
+        self.output = FileObject(os.dup(sys.stdout.fileno()), 'wb')
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        super(WorkerBridge, self).__init__(config)
+        self.metrics_port = None
+        # tenders are reported released when the worker holds them no more
+        self.received_seq = 0
+        self.received_ids = set()
+        self.held_ids = set()
+
+    @property
+    def pending_contracts_key(self):
+        return '{}:{}'.format(PENDING_CONTRACTS_KEY, self.worker_number)
+
+    @property
+    def queues_journal_name(self):
+        return 'contracting_databridge_queues_{}'.format(self.worker_number)
+
+    @property
+    def dead_letters_name(self):
+        return 'contracts_{}'.format(self.worker_number)
+
+    def read_messages(self):
+        for line in iter(self.input.readline, ''):
+            message = json.loads(line)
+            if 'contracts_index' in message:
+                self.contracts_index_state = message['contracts_index']['state']
+                self.contracts_index_checked_at = message['contracts_index']['checked_at']
+            if 'tender' in message:
+                self.tenders_queue.put(message['tender'], lane=message.get('lane', FRESH_LANE))
+                self.received_ids.add(message['tender']['id'])
+                self.received_seq = message['seq']
+        logger.info('Parent process closed the input of worker {}'.format(self.worker_number),
+                    extra=journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {}))
+
+    def held_tenders(self):
+        """ Ids of tenders with contracts still to be synced """
+        held = set(self.tenders_queue.keys())
+        held.update(self.tenders_locks.keys())
+        held.update(self.pending_contracts.tender_ids())
+        return held
+
+    def report_state(self):
+        held = self.held_tenders()
+        state = {'worker': self.worker_number,
+                 'received': self.received_seq,
+                 'released': list((self.held_ids | self.received_ids) - held),
+                 'tenders_queue': self.tenders_queue.qsize(),
+                 'contracts_put_queue': self.contracts_put_queue.qsize(),
+                 'pending_contracts': len(self.pending_contracts),
+                 'counters': [[name, labels, value] for (name, labels), value in self.metrics.counters.items()]}
+        self.held_ids = held
+        self.received_ids = set()
+        self.output.write(json.dumps(state) + '\n')
+        self.output.flush()
+
+    def _start_synchronization_workers(self):
+        self.jobs = [gevent.spawn(self.read_messages)]
+
+    def _start_contract_sculptors(self):
+        super(WorkerBridge, self)._start_contract_sculptors()
+        # contracts index is synced by the parent process
+        index_job = self.immortal_jobs.pop('sync_contracts_index', None)
+        if index_job is not None:
+            index_job.kill()
+
+    def _check_synchronization_workers(self):
+        self.report_state()
+        if self.jobs[0].dead:
+            # no more tenders will come
+            self.stop()
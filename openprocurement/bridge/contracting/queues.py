@@ -0,0 +1,350 @@
+import json
+import os
+from collections import OrderedDict, deque
+from heapq import heappop, heappush
+from itertools import count
+from random import uniform
+from time import time
+
+from gevent.event import Event
+from gevent.queue import Queue
+from munch import munchify
+
+
+class Lanes(object):
+    """ FIFO lanes served by weighted round robin
+
+    Every round a lane gives out up to its weight of items, lanes with a
+    lower index go first and a lane without items gives its turn away, so
+    a busy lane never blocks the others. Items are appended as
+    `(lane, item)` pairs; the class stands in for the deque of gevent queue.
+
+    With `key` the lanes hold at most one item per key: an item with the
+    key of a waiting one is merged into it with `merge(waiting, item)` and
+    keeps the place of the waiting item, unless it comes to a lane with a
+    lower index, then the merged item moves to the end of that lane.
+    """
+
+    def __init__(self, weights, key=None, merge=None):
+        self.weights = weights
+        self.key = key
+        self.merge = merge
+        self.lanes = [deque() for weight in weights]
+        self.credits = list(weights)
+        self.waiting = {}
+        self.waiting_lanes = {}
+        self.coalesced = 0
+        # lane of the last item given out
+        self.last_lane = None
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def _next_lane(self):
+        for index, lane in enumerate(self.lanes):
+            if lane and self.credits[index] > 0:
+                return index
+        self.credits = list(self.weights)
+        for index, lane in enumerate(self.lanes):
+            if lane and self.credits[index] > 0:
+                return index
+        # lanes with zero weight are served only when the others are empty
+        for index, lane in enumerate(self.lanes):
+            if lane:
+                return index
+        raise IndexError('pop from empty lanes')
+
+    def append(self, entry):
+        lane, item = entry
+        if self.key is None:
+            self.lanes[lane].append(item)
+            return
+        key = self.key(item)
+        if key in self.waiting:
+            self.waiting[key] = self.merge(self.waiting[key], item)
+            self.coalesced += 1
+            if lane < self.waiting_lanes[key]:
+                self.lanes[self.waiting_lanes[key]].remove(key)
+                self.lanes[lane].append(key)
+                self.waiting_lanes[key] = lane
+        else:
+            self.waiting[key] = item
+            self.waiting_lanes[key] = lane
+            self.lanes[lane].append(key)
+
+    def popleft(self):
+        index = self._next_lane()
+        self.credits[index] -= 1
+        self.last_lane = index
+        item = self.lanes[index].popleft()
+        if self.key is None:
+            return item
+        del self.waiting_lanes[item]
+        return self.waiting.pop(item)
+
+    def __getitem__(self, index):
+        if index != 0:
+            raise IndexError(index)
+        item = self.lanes[self._next_lane()][0]
+        return item if self.key is None else self.waiting[item]
+
+
+class MemoryQueue(Queue):
+    """ In-memory pipeline queue, acknowledgements are no-op
+
+    `weights` gives the number of lanes and their shares of gets. With
+    `key` items with the same key are coalesced while they wait in the
+    queue, keeping the one with the greatest `version`.
+    """
+
+    def __init__(self, maxsize=None, weights=(1,), key=None, version=None):
+        self.weights = weights
+        self.key = key
+        self.version = version
+        Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize, items=None):
+        self.queue = Lanes(self.weights, self._entry_key if self.key else None, self._merge)
+
+    def _entry_key(self, entry):
+        return self.key(entry)
+
+    def _merge(self, waiting, entry):
+        return entry if self.version(entry) > self.version(waiting) else waiting
+
+    def put(self, item, block=True, timeout=None, lane=0):
+        if self.key is not None and self._entry_key(item) in self.queue.waiting:
+            # coalesced item takes no slot, so it never waits for one
+            self._put((lane, item))
+        else:
+            Queue.put(self, (lane, item), block, timeout)
+
+    @property
+    def coalesced(self):
+        return self.queue.coalesced
+
+    def get_entry(self, block=True, timeout=None):
+        """ Get `(lane, item)`, so a failed item can be put back into its lane """
+        item = self.get(block, timeout)
+        # the item is taken in this greenlet right before get returns
+        return self.queue.last_lane, item
+
+    def lane_size(self, lane):
+        return len(self.queue.lanes[lane])
+
+    def keys(self):
+        """ Keys of waiting items """
+        return self.queue.waiting.keys()
+
+    def ack(self, item):
+        pass
+
+
+class DurableQueue(MemoryQueue):
+    """ Pipeline queue that keeps items in a journal until acknowledged
+
+    Items left in the journal by the previous run are queued again on
+    creation. Every put gets its own journal entry and `ack` removes the
+    entry of the delivery returned by `get`, so an item that is put back
+    into the queue while it is processed survives acknowledgement of the
+    processed delivery.
+
+    The journal is written by `put` and `ack` only. A put blocked on a full
+    queue is finished by the hub, which cannot wait for journal I/O, so
+    items are journaled before they are queued and entries of coalesced
+    items are removed once the put returns.
+    """
+
+    def __init__(self, journal, name, maxsize=None, weights=(1,), key=None, version=None):
+        self.journal = journal
+        self.name = name
+        self._processing = {}
+        self._dropped = []
+        MemoryQueue.__init__(self, maxsize, weights, key, version)
+        for key, lane, item in journal.load(name):
+            Queue._put(self, (lane, (key, munchify(item))))
+
+    def _entry_key(self, entry):
+        return self.key(entry[1])
+
+    def _merge(self, waiting, entry):
+        kept = entry if self.version(entry[1]) > self.version(waiting[1]) else waiting
+        self._dropped.append((waiting if kept is entry else entry)[0])
+        return kept
+
+    def put(self, item, block=True, timeout=None, lane=0):
+        key = self.journal.add(self.name, item, lane)
+        queued = False
+        try:
+            MemoryQueue.put(self, (key, item), block, timeout, lane)
+            queued = True
+        finally:
+            if not queued:
+                self._dropped.append(key)
+            while self._dropped:
+                self.journal.remove(self.name, self._dropped.pop())
+
+    def _get(self):
+        key, item = Queue._get(self)
+        self._processing[key] = item
+        return item
+
+    def _peek(self):
+        return Queue._peek(self)[1]
+
+    def ack(self, item):
+        # an item put back is the same object, so it may be processed under
+        # several deliveries at once, the earliest is acknowledged first
+        for key in sorted(self._processing):
+            if self._processing[key] is item:
+                del self._processing[key]
+                self.journal.remove(self.name, key)
+                return
+
+
+class DelayQueue(object):
+    """ Items waiting for their next attempt
+
+    Items are kept in a heap by the time of the next attempt, so any
+    number of them can back off at once and `get` returns whichever is due
+    first. Delay doubles with every attempt of a key up to `max_delay` and
+    is jittered down to a half of it, so items failed together do not come
+    back together.
+    """
+
+    def __init__(self, base_delay=60, max_delay=3600, max_attempts=15):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.attempts = {}
+        self._heap = []
+        self._sequence = count()
+        self._changed = Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return uniform(delay / 2.0, delay)
+
+    def schedule(self, key, item):
+        """ Schedule next attempt of item, return False if attempts are exhausted """
+        attempt = self.attempts.get(key, 0) + 1
+        if attempt > self.max_attempts:
+            del self.attempts[key]
+            return False
+        self.attempts[key] = attempt
+        heappush(self._heap, (time() + self.delay(attempt), next(self._sequence), key, item))
+        self._changed.set()
+        return True
+
+    def done(self, key):
+        """ Forget attempts of key after success """
+        self.attempts.pop(key, None)
+
+    def get(self):
+        """ Wait for the first due item and return `(key, item)` """
+        while True:
+            self._changed.clear()
+            if self._heap and self._heap[0][0] <= time():
+                due, sequence, key, item = heappop(self._heap)
+                return key, item
+            self._changed.wait(self._heap[0][0] - time() if self._heap else None)
+
+
+class RedisJournal(object):
+    """ Queue journal kept in Redis, one hash per queue """
+
+    def __init__(self, redis, prefix):
+        self.redis = redis
+        self.prefix = prefix
+        # keys keep growing across restarts, so they give the queue order
+        self._sequence = count(int(time() * 1000000))
+
+    def _hash(self, name):
+        return '{}:{}'.format(self.prefix, name)
+
+    def add(self, name, item, lane=0):
+        key = next(self._sequence)
+        self.redis.hset(self._hash(name), key, json.dumps([lane, item]))
+        return key
+
+    def remove(self, name, key):
+        self.redis.hdel(self._hash(name), key)
+
+    def load(self, name):
+        entries = self.redis.hgetall(self._hash(name))
+        return sorted([int(key)] + json.loads(value) for key, value in entries.items())
+
+    def close(self):
+        pass
+
+
+class FileJournal(object):
+    """ Queue journal kept in an append-only segment file
+
+    Every put appends an add record and every acknowledgement a remove
+    record. The segment is rewritten with live entries only when removed
+    records outnumber them.
+    """
+
+    def __init__(self, path, fsync=False, compact_threshold=10000):
+        self.path = path
+        self.fsync = fsync
+        self.compact_threshold = compact_threshold
+        self._entries = OrderedDict()
+        self._removed = 0
+        last_key = -1
+        if os.path.exists(path):
+            with open(path) as segment:
+                for line in segment:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # record torn by a crash
+                    if record[0] == '+':
+                        self._entries[(record[1], record[2])] = (record[3], record[4])
+                        last_key = max(last_key, record[2])
+                    else:
+                        self._entries.pop((record[1], record[2]), None)
+        self._sequence = count(last_key + 1)
+        self._file = open(path, 'a')
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def add(self, name, item, lane=0):
+        key = next(self._sequence)
+        self._write(['+', name, key, lane, item])
+        self._entries[(name, key)] = (lane, item)
+        return key
+
+    def remove(self, name, key):
+        if self._entries.pop((name, key), None) is None:
+            return
+        self._write(['-', name, key])
+        self._removed += 1
+        if self._removed > self.compact_threshold and self._removed > len(self._entries):
+            self.compact()
+
+    def load(self, name):
+        return [(key, lane, item) for (entry_name, key), (lane, item) in self._entries.items()
+                if entry_name == name]
+
+    def compact(self):
+        self._file.close()
+        with open(self.path + '.tmp', 'w') as segment:
+            for (name, key), (lane, item) in self._entries.items():
+                segment.write(json.dumps(['+', name, key, lane, item]) + '\n')
+            segment.flush()
+            os.fsync(segment.fileno())
+        os.rename(self.path + '.tmp', self.path)
+        self._file = open(self.path, 'a')
+        self._removed = 0
+
+    def close(self):
+        self._file.close()
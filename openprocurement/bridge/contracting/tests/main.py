@@ -4,7 +4,8 @@ import unittest
 import json
 
 import exceptions
-from mock import patch, call, MagicMock
+import signal
+from mock import ANY, patch, call, MagicMock
 from munch import munchify
 from datetime import datetime
 try:  # compatibility with requests-based or restkit-based op.client.python
@@ -13,7 +14,7 @@ except ImportError:
     from restkit.errors import ResourceGone
 # from time import sleep
 from openprocurement_client.client import ResourceNotFound
-from openprocurement.bridge.contracting.databridge import ContractingDataBridge
+from openprocurement.bridge.contracting.databridge import ContractingDataBridge, Db
 from openprocurement.bridge.contracting.journal_msg_ids import (
     DATABRIDGE_INFO, DATABRIDGE_START
 )
@@ -116,7 +117,7 @@ class TestDatabridge(unittest.TestCase):
 
         spawn_calls = mocked_gevent.spawn.call_args_list
 
-        self.assertEqual(len(spawn_calls), 154)
+        self.assertEqual(len(spawn_calls), 176)
         self.assertEqual(
             self._get_calls_count(spawn_calls, call(cb.get_tender_contracts)), 22)
         self.assertEqual(
@@ -127,6 +128,8 @@ class TestDatabridge(unittest.TestCase):
             self._get_calls_count(spawn_calls, call(cb.put_contracts)), 22)
         self.assertEqual(
             self._get_calls_count(spawn_calls, call(cb.retry_put_contracts)), 22)
+        self.assertEqual(
+            self._get_calls_count(spawn_calls, call(cb.retry_delayed_contracts)), 22)
         self.assertEqual(
             self._get_calls_count(spawn_calls, call(cb.get_tender_contracts_backward)), 22)
         self.assertEqual(
@@ -207,6 +210,79 @@ class TestDatabridge(unittest.TestCase):
         self.assertEqual(cb._restart_synchronization_workers.call_count, 0)
 
 
+    @patch('openprocurement.bridge.contracting.databridge.gevent')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    @patch('openprocurement.bridge.contracting.databridge.INFINITY_LOOP')
+    def test_run_with_tenders_workers(
+            self, mocked_loop, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
+        mocked_loop.__nonzero__.side_effect = [True, False]
+        cb = ContractingDataBridge({'main': {'tenders_workers_count': 3}})
+        cb.run()
+
+        self.assertEqual(
+            sorted(name for name in cb.immortal_jobs if name.startswith('get_tender_contracts')),
+            ['get_tender_contracts', 'get_tender_contracts:1', 'get_tender_contracts:2'])
+        spawn_calls = mocked_gevent.spawn.call_args_list
+        # 3 tender workers were started and all of them restarted once
+        self.assertEqual(
+            self._get_calls_count(spawn_calls, call(cb.get_tender_contracts)), 6)
+        warn_calls = mocked_logger.warn.call_args_list
+        self.assertEqual(
+            self._get_calls_count(warn_calls, call('Restarting get_tender_contracts:2 worker')), 1)
+
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_get_tender_contracts_same_tender_is_serialized(
+            self, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db):
+        import gevent
+        cb = ContractingDataBridge({'main': {}})
+        tender_to_sync = {'id': '1' * 32, 'dateModified': datetime.now().isoformat()}
+        cb.tenders_queue.put(tender_to_sync)
+        handled = []
+
+        def sync_tender_contracts(tender, lane):
+            handled.append(('start', tender['id']))
+            gevent.sleep(0.01)
+            handled.append(('stop', tender['id']))
+
+        cb._sync_tender_contracts = sync_tender_contracts
+        first = gevent.spawn(cb._get_tender_contracts)
+        gevent.sleep(0)
+        # the tender comes again while it is processed
+        cb.tenders_queue.put(dict(tender_to_sync))
+        gevent.joinall([first, gevent.spawn(cb._get_tender_contracts)])
+
+        self.assertEqual(handled, [('start', '1' * 32), ('stop', '1' * 32),
+                                   ('start', '1' * 32), ('stop', '1' * 32)])
+        self.assertFalse(cb.tenders_locks.locked('1' * 32))
+
+    def test_keyed_lock_killed_waiter(self):
+        import gevent
+        from openprocurement.bridge.contracting.utils import KeyedLock
+        locks = KeyedLock()
+
+        def hold(seconds):
+            with locks('t1'):
+                gevent.sleep(seconds)
+
+        owner = gevent.spawn(hold, 0.01)
+        waiter = gevent.spawn(hold, 0)
+        gevent.sleep(0)
+        self.assertTrue(locks.locked('t1'))
+        # a waiter killed before it gets the lock does not keep the key
+        waiter.kill()
+        owner.join()
+        self.assertFalse(locks.locked('t1'))
+        self.assertEqual(len(locks), 0)
+
     @patch('openprocurement.bridge.contracting.databridge.Db')
     @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
     @patch('openprocurement.bridge.contracting.databridge.TendersClient')
@@ -258,16 +334,64 @@ class TestDatabridge(unittest.TestCase):
                                              mocked_sync_client, mocked_db):
         cb = ContractingDataBridge({'main': {}})
         tender_id = '2001'
-        cb.basket = {'1': 'one', '2': 'two', '42': 'why'}
+        cb.pending_contracts.add('1', '1999', 'one')
+        cb.pending_contracts.add('2', tender_id, 'why')
+        cb.pending_contracts.add('42', tender_id, 'why')
         cb.cache_db = MagicMock()
 
         cb._put_tender_in_cache_by_contract({'id': '1984'}, tender_id)
-        self.assertEqual(cb.basket.get('42', None), 'why')
+        self.assertIn('42', cb.pending_contracts)
         self.assertEqual(cb.cache_db.put.called, False)
 
+        # tender still has pending contract
         cb._put_tender_in_cache_by_contract({'id': '42'}, tender_id)
-        self.assertEqual(cb.basket.get('42', None), None)
+        self.assertNotIn('42', cb.pending_contracts)
+        self.assertEqual(cb.cache_db.put.called, False)
+
+        cb._put_tender_in_cache_by_contract({'id': '2'}, tender_id)
         cb.cache_db.put.assert_called_once_with('2001', 'why')
+        self.assertEqual(len(cb.pending_contracts), 1)
+
+        # permanently failed contract drops its tender
+        cb.pending_contracts.add('3', '1999', 'one')
+        cb.pending_contracts.fail('3')
+        cb._put_tender_in_cache_by_contract({'id': '1'}, '1999')
+        self.assertEqual(cb.cache_db.put.call_count, 1)
+        self.assertEqual((len(cb.pending_contracts), cb.pending_contracts.failed), (0, 2))
+
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_pending_contracts_limits_and_persistence(
+            self, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db, mocked_logger):
+        cb = ContractingDataBridge({'main': {'pending_contracts_limit': 3,
+                                             'pending_contracts_max_age': 60}})
+        cb.pending_contracts.add('1', 't1', 'd1', added=1)
+        cb.pending_contracts.add('2', 't1', 'd1', added=1)
+        cb.pending_contracts.add('3', 't2', 'd2')
+        cb.pending_contracts.add('4', 't3', 'd3')
+        # the oldest tender is evicted with all its contracts
+        self.assertEqual(sorted(cb.pending_contracts.dump())[0][:3], ['3', 't2', 'd2'])
+        self.assertEqual((len(cb.pending_contracts), cb.pending_contracts.evicted), (2, 2))
+        cb.pending_contracts.expire()
+        self.assertEqual(cb.pending_contracts.expired, 0)
+
+        cb.save_pending_contracts()
+        saved = cb.cache_db.put.call_args[0]
+        cb.pending_contracts.max_age = 0.000001
+        cb.pending_contracts.expire()
+        self.assertEqual((len(cb.pending_contracts), cb.pending_contracts.expired), (0, 2))
+        mocked_db.return_value.get.return_value = saved[1]
+        cb = ContractingDataBridge({'main': {'persist_pending_contracts': True}})
+        cb.cache_db.get.assert_called_once_with('contracting_databridge_pending_contracts')
+        self.assertEqual(saved[0], 'contracting_databridge_pending_contracts')
+        self.assertEqual(len(cb.pending_contracts), 2)
+        cb.requeue_pending_tenders()
+        self.assertEqual([cb.tenders_queue.get() for i in range(2)],
+                         [{'id': 't2', 'dateModified': 'd2'}, {'id': 't3', 'dateModified': 'd3'}])
 
     @patch('openprocurement.bridge.contracting.databridge.Db')
     @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
@@ -325,7 +449,7 @@ class TestDatabridge(unittest.TestCase):
 
         keyboard_interrut_log = call('Exiting...')
         kill_all_jobs = call(cb.jobs, timeout=5)
-        kill_all_immortal_jobs = call(cb.immortal_jobs, timeout=5)
+        kill_all_immortal_jobs = call(cb.immortal_jobs.values(), timeout=5)
 
         self.assertEqual(self._get_calls_count(logger_calls, keyboard_interrut_log), 1)
         self.assertEqual(self._get_calls_count(gevent_calls, kill_all_jobs), 1)
@@ -443,6 +567,57 @@ class TestDatabridge(unittest.TestCase):
             cb.sync_single_tender(tender_id)
         mocked_logger.exception.assert_called_once_with(e.exception)
 
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_sync_tenders(self, mocked_contract_client, mocked_tender_client,
+                          mocked_sync_client, mocked_db, mocked_logger):
+        import gevent
+        from openprocurement.bridge.contracting.databridge import read_tender_ids
+        self.assertEqual(list(read_tender_ids(['# incident\n', 't1\n', '\n', ' t2 \n', 't1\n'])), ['t1', 't2'])
+
+        cb = ContractingDataBridge({'main': {}})
+        tenders = {'t1': [{'status': 'active', 'id': 'c1'}, {'status': 'cancelled', 'id': 'c2'}],
+                   't2': [{'status': 'active', 'id': 'c3'}, {'status': 'active', 'id': 'c4'}],
+                   't3': [{'status': 'active', 'id': 'c5'}]}
+
+        def get_tender(tender_id):
+            return {'data': munchify({'id': tender_id, 'status': 'complete', 'owner': 'owner',
+                                      'procuringEntity': {}, 'contracts': tenders[tender_id]})}
+
+        def get_contract(contract_id):
+            if contract_id == 'c3':
+                return {'data': {'id': contract_id}}
+            raise ResourceNotFound()
+
+        creating = []
+        most_creating = []
+
+        def create_contract(data):
+            if data['data']['id'] == 'c5':
+                raise Exception('Boom!')
+            creating.append(data['data']['id'])
+            most_creating.append(len(creating))
+            gevent.sleep(0.01)
+            creating.remove(data['data']['id'])
+            return data
+
+        cb.tenders_sync_client.get_tender = MagicMock(side_effect=get_tender)
+        cb.get_tender_credentials = MagicMock(side_effect=lambda tender_id: {'data': {'tender_token': 'token'}})
+        cb.contracting_client.get_contract = MagicMock(side_effect=get_contract)
+        cb.contracting_client.create_contract = MagicMock(side_effect=create_contract)
+
+        summary = cb.sync_tenders(iter(['t1', 't2', 't3']), concurrency=3)
+        # contracts of the tenders are created at once
+        self.assertEqual(max(most_creating), 2)
+        self.assertEqual(sorted(summary['created']), ['c1', 'c4'])
+        self.assertEqual(summary['existing'], ['c3'])
+        self.assertEqual(summary['failed'], [{'tender_id': 't3', 'contract_id': 'c5', 'error': 'Exception: Boom!'}])
+        self.assertEqual(summary['tenders'], 3)
+        self.assertEqual([c[0][0] for c in cb.get_tender_credentials.call_args_list], ['t1', 't2', 't3'])
+
 
     @patch('openprocurement.bridge.contracting.databridge.Db')
     @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
@@ -458,12 +633,11 @@ class TestDatabridge(unittest.TestCase):
         true_list = [True, False]
         mocked_loop.__nonzero__.side_effect = true_list
 
-        contract = {'id': '42', 'tender_id': '1984'}
+        contract = munch.munchify({'id': '42', 'tender_id': '1984'})
 
         bridge = ContractingDataBridge({'main': {}})
-        remember_put_with_retry = bridge._put_with_retry
         bridge.contracts_retry_put_queue = MagicMock()
-        bridge._put_with_retry = MagicMock()
+        bridge.contracting_client = MagicMock()
         bridge.cache_db = MagicMock()
         bridge._put_tender_in_cache_by_contract = MagicMock()
         bridge.contracts_retry_put_queue.get.return_value = contract
@@ -471,21 +645,24 @@ class TestDatabridge(unittest.TestCase):
         bridge.retry_put_contracts()
 
         bridge.contracts_retry_put_queue.get.assert_called_once_with()
-        bridge._put_with_retry.assert_called_once_with(contract)
+        bridge.contracting_client.create_contract.assert_called_once_with({'data': contract.toDict()})
         bridge.cache_db.put.assert_called_once_with(contract['id'], True)
         bridge._put_tender_in_cache_by_contract.assert_called_once_with(contract,
                                                                         contract['tender_id'])
+        bridge.contracts_retry_put_queue.ack.assert_called_once_with(contract)
         mocked_gevent.sleep.assert_called_once_with(0)
 
-        bridge._put_with_retry = remember_put_with_retry
+        # failed contract is delayed without blocking the worker
         mocked_loop.__nonzero__.side_effect = true_list
         e = Exception('Boom!')
-        bridge.contracting_client.create_contract = MagicMock(side_effect=[e, True])
-        contract = munch.munchify(contract)
-        bridge.contracts_retry_put_queue.get.return_value = contract
+        bridge.contracting_client.create_contract = MagicMock(side_effect=e)
+        bridge.contracts_retry_put_queue.reset_mock()
         bridge.retry_put_contracts()
 
         mocked_logger.exception.assert_called_once_with(e)
+        self.assertEqual(len(bridge.retry_delays), 1)
+        self.assertEqual(bridge.retry_delays.attempts, {('contracts_retry_put_queue', '42'): 1})
+        self.assertFalse(bridge.contracts_retry_put_queue.ack.called)
 
     @patch('openprocurement.bridge.contracting.databridge.Db')
     @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
@@ -521,9 +698,10 @@ class TestDatabridge(unittest.TestCase):
 
         list_contracts = []
         for i in range(0, 10):
-            list_contracts.append(dict(id=i, tender_id=(i+100)))
+            list_contracts.append(munch.munchify(dict(id=i, tender_id=(i+100))))
         bridge.contracts_put_queue = MagicMock()
         bridge.contracts_put_queue.get.side_effect = list_contracts
+        bridge.contracting_client.create_contract.side_effect = Exception('Boom!')
         list_loop = [True for i in range(0, 10)]
         list_loop.append(False)
         mocked_loop.__nonzero__.side_effect = list_loop
@@ -534,7 +712,79 @@ class TestDatabridge(unittest.TestCase):
         for i in range(0, 10):
             assert extract_calls[i]['id'] == i
         self.assertEqual(len(extract_calls), 10)
+        # write breaker opened after 10 failures in a row
         bridge.contracting_client_init.assert_called_once_with()
+        self.assertEqual(bridge.breakers['contracting_write'].state, 'open')
+
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.INFINITY_LOOP')
+    def test_put_contracts_concurrently(
+            self, mocked_loop, mocked_logger, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db):
+        import gevent
+        mocked_loop.__nonzero__.side_effect = [True, True, True, True, False]
+        bridge = ContractingDataBridge({'main': {'put_contracts_workers_count': 4}})
+        for i in range(4):
+            bridge.contracts_put_queue.put(munch.munchify({'id': str(i), 'tender_id': '1984'}))
+        bridge.cache_db = MagicMock()
+        bridge._put_tender_in_cache_by_contract = MagicMock()
+        bridge.contracting_client_init = MagicMock()
+        created = []
+
+        def create_contract(data):
+            # the first contracts are the slowest ones
+            gevent.sleep(0.01 * (4 - int(data['data']['id'])))
+            if data['data']['id'] == '1':
+                raise Exception('Boom!')
+            created.append(data['data']['id'])
+
+        bridge.contracting_client.create_contract = MagicMock(side_effect=create_contract)
+        bridge.put_contracts()
+
+        self.assertEqual(created, ['3', '2', '0'])
+        self.assertEqual([c[0][0]['id'] for c in bridge._put_tender_in_cache_by_contract.call_args_list],
+                         ['0', '2', '3'])
+        self.assertEqual(bridge.contracts_retry_put_queue.get()['id'], '1')
+        self.assertEqual(bridge.contracting_client_init.call_count, 0)
+
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.INFINITY_LOOP')
+    def test_put_contracts_conflict(
+            self, mocked_loop, mocked_logger, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db):
+        from openprocurement_client.exceptions import Conflict
+        bridge = ContractingDataBridge({'main': {}})
+        bridge.cache_db = MagicMock()
+        bridge.contracting_client.create_contract.side_effect = Conflict(MagicMock(status_code=409))
+        bridge.pending_contracts.add('42', '1984', '2017-01-01')
+        bridge.pending_contracts.add('43', '1985', '2017-01-02')
+
+        # contract created by someone else after its lookup is taken as existing
+        mocked_loop.__nonzero__.side_effect = [True, False]
+        bridge.contracts_put_queue.put(munch.munchify({'id': '42', 'tender_id': '1984'}))
+        bridge.put_contracts()
+        self.assertEqual(bridge.contracts_retry_put_queue.qsize(), 0)
+        self.assertEqual(bridge.cache_db.put.call_args_list,
+                         [call('42', True), call('1984', '2017-01-01')])
+
+        mocked_loop.__nonzero__.side_effect = [True, False]
+        bridge.cache_db.reset_mock()
+        bridge.contracts_retry_put_queue.put(munch.munchify({'id': '43', 'tender_id': '1985'}))
+        bridge.retry_put_contracts()
+        self.assertEqual(len(bridge.retry_delays), 0)
+        self.assertEqual(bridge.cache_db.put.call_args_list,
+                         [call('43', True), call('1985', '2017-01-02')])
+        self.assertEqual(bridge.metrics.get('contract_create_conflicts_total'), 2)
+        self.assertEqual(bridge.metrics.get('contract_create_errors_total'), 0)
+        self.assertEqual(bridge.breakers['contracting_write'].state, 'closed')
 
 
     @patch('openprocurement.bridge.contracting.databridge.gevent')
@@ -557,7 +807,7 @@ class TestDatabridge(unittest.TestCase):
         tender_data = MagicMock()
         tender_data.data = {'owner': 'owner', 'tender_token': 'tender_token'}
         cb.handicap_contracts_queue_retry.get = MagicMock(return_value=contract)
-        cb.get_tender_data_with_retry = MagicMock(return_value=tender_data)
+        cb.get_tender_credentials_shared = MagicMock(return_value=tender_data)
         cb.prepare_contract_data_retry()
         self.assertEquals(cb.contracts_put_queue.qsize(), 1)
         self.assertEquals(cb.contracts_put_queue.get(), contract)
@@ -581,9 +831,25 @@ class TestDatabridge(unittest.TestCase):
         contract = {'id': 0, 'tender_id': 1111}
         cb.handicap_contracts_queue_retry.get = MagicMock(return_value=contract)
         e = Exception("Error!!! prepare_contract_data_retry")
-        cb.get_tender_data_with_retry = MagicMock(side_effect=e)
+        cb.get_tender_credentials_shared = MagicMock(side_effect=e)
         cb.prepare_contract_data_retry()
         mocked_logger.exception.assert_called_with(e)
+        self.assertEqual(cb.retry_delays.attempts, {('handicap_contracts_queue_retry', 0): 1})
+
+        # contract fails once attempts are exhausted and goes to dead letters
+        import tempfile
+        cb.config['main']['queue_dir'] = tempfile.mkdtemp()
+        cb.retry_delays.max_attempts = 1
+        cb.pending_contracts.add(0, 1111, '')
+        mocked_loop.__nonzero__.side_effect = [True, False]
+        cb.prepare_contract_data_retry()
+        self.assertEqual(cb.retry_delays.attempts, {})
+        self.assertEqual((len(cb.pending_contracts), cb.pending_contracts.failed), (0, 1))
+        self.assertEqual(cb.metrics.get('contracts_failed_total'), 1)
+        [(key, lane, letter)] = cb.dead_letters.load('contracts')
+        self.assertEqual((letter['contract'], letter['queue'], letter['reason'], letter['attempts']),
+                         (contract, 'handicap_contracts_queue_retry',
+                          'Exception: Error!!! prepare_contract_data_retry', 2))
 
 
     @patch('openprocurement.bridge.contracting.databridge.gevent')
@@ -614,6 +880,60 @@ class TestDatabridge(unittest.TestCase):
         self.assertEquals(cb.contracts_put_queue.qsize(), 1)
         self.assertEquals(cb.contracts_put_queue.get(), contract)
 
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch(
+        'openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch(
+        'openprocurement.bridge.contracting.databridge.ContractingClient')
+    @patch('openprocurement.bridge.contracting.databridge.INFINITY_LOOP')
+    def test_prepare_contract_data_shares_tender_credentials(
+            self, mocked_loop, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db, mocked_logger):
+        import gevent
+        mocked_loop.__nonzero__.side_effect = [True, True, True, False]
+        cb = ContractingDataBridge({'main': {'credentials_workers_count': 3}})
+        for i in range(3):
+            cb.handicap_contracts_queue.put({'id': i, 'tender_id': 1111})
+
+        tender_data = MagicMock()
+        tender_data.data = {'owner': 'owner', 'tender_token': 'tender_token'}
+
+        def get_tender_credentials(tender_id):
+            gevent.sleep(0.01)
+            return tender_data
+
+        cb.get_tender_credentials = MagicMock(side_effect=get_tender_credentials)
+        cb.prepare_contract_data()
+
+        cb.get_tender_credentials.assert_called_once_with(1111)
+        self.assertEqual([cb.contracts_put_queue.get()['id'] for i in range(3)], [0, 1, 2])
+        self.assertEqual(cb.credentials_cache.get(1111), tender_data)
+        self.assertEqual(cb.credentials_requests, {})
+
+        # cached credentials are used without request
+        cb.get_tender_credentials.reset_mock()
+        self.assertEqual(cb.get_tender_credentials_shared(1111), tender_data)
+        self.assertEqual(cb.get_tender_credentials.call_count, 0)
+
+        # waiters of a killed request get an error instead of waiting forever
+        errors = []
+
+        def wait_credentials():
+            try:
+                cb.get_tender_credentials_shared(2222)
+            except Exception, e:
+                errors.append(e)
+
+        owner = gevent.spawn(cb.get_tender_credentials_shared, 2222)
+        waiter = gevent.spawn(wait_credentials)
+        gevent.sleep(0)
+        owner.kill()
+        waiter.join(timeout=1)
+        self.assertEqual([type(e) for e in errors], [RuntimeError])
+        self.assertEqual(cb.credentials_requests, {})
+
     @patch('openprocurement.bridge.contracting.databridge.gevent')
     @patch('openprocurement.bridge.contracting.databridge.logger')
     @patch('openprocurement.bridge.contracting.databridge.Db')
@@ -627,7 +947,7 @@ class TestDatabridge(unittest.TestCase):
             self, mocked_loop, mocked_contract_client, mocked_tender_client,
             mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
 
-        static_number = 12
+        static_number = 10
         true_list = [True for i in xrange(0, static_number)]
         true_list.append(False)
         mocked_loop.__nonzero__.side_effect = true_list
@@ -646,12 +966,17 @@ class TestDatabridge(unittest.TestCase):
         list_calls = mocked_gevent.sleep.call_args_list
         calls_logs = mocked_logger.info.call_args_list
 
+        # failures go to retry queue without slowing the stage down
         calls_with_error_delay = call(cb.on_error_delay)
-        self.assertEqual(self._get_calls_count(list_calls, calls_with_error_delay), static_number)
+        self.assertEqual(self._get_calls_count(list_calls, calls_with_error_delay), 0)
+        self.assertEqual(cb.handicap_contracts_queue_retry.qsize(), static_number)
 
-        reconnecting_log = call('Reconnecting tenders client',
-                                extra={'JOURNAL_TENDER_ID': 1120, 'MESSAGE_ID': 'c_bridge_reconnect', 'JOURNAL_CONTRACT_ID': 9})
+        reconnecting_log = call('Reconnecting tenders client', extra={'MESSAGE_ID': 'c_bridge_reconnect'})
         self.assertEqual(self._get_calls_count(calls_logs, reconnecting_log), 1)
+        self.assertEqual(mocked_tender_client.call_count, 2)
+        self.assertEqual(cb.breakers['tenders_credentials'].state, 'open')
+        self.assertIn('contracting_databridge_circuit_breaker_open{upstream="tenders_credentials"} 1',
+                      cb.metrics.render().splitlines())
 
     @patch('openprocurement.bridge.contracting.databridge.gevent')
     @patch('openprocurement.bridge.contracting.databridge.logger')
@@ -698,7 +1023,7 @@ class TestDatabridge(unittest.TestCase):
         }
         cb.tenders_queue.put(tender_to_sync)
         cb.cache_db = MagicMock()
-        cb.cache_db.has.return_value = False
+        cb.cache_db.has_many.return_value = [False]
         cb.tenders_sync_client = MagicMock()
         cb.tenders_sync_client.get_tender.return_value = tender
         exception = ResourceGone(response=resp)
@@ -714,6 +1039,992 @@ class TestDatabridge(unittest.TestCase):
         }
         mocked_logger.info.assert_has_calls([call(logger_msg, extra=extra)])
 
+    @patch('openprocurement.bridge.contracting.databridge.gevent')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_get_tender_contracts_batch_cache_lookup(
+            self, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
+        cb = ContractingDataBridge({'main': {}})
+        tender_to_sync = {'id': '1' * 32, 'dateModified': datetime.now().isoformat()}
+        cb.tenders_queue.put(tender_to_sync)
+        cb.tenders_sync_client = MagicMock()
+        cb.tenders_sync_client.get_tender.return_value = {'data': {
+            'id': '1' * 32,
+            'contracts': [{'id': '2' * 32, 'status': 'active'},
+                          {'id': '3' * 32, 'status': 'cancelled'},
+                          {'id': '4' * 32, 'status': 'active'},
+                          {'id': '5' * 32, 'status': 'active'}]}}
+        cb.cache_db = MagicMock()
+        cb.cache_db.has_many.return_value = [True, False, False]
+        cb.contracting_client_ro = MagicMock()
+
+        cb._get_tender_contracts()
+
+        cb.cache_db.has_many.assert_called_once_with(['2' * 32, '4' * 32, '5' * 32])
+        self.assertEqual(cb.cache_db.has.call_count, 0)
+        self.assertEqual(cb.contracting_client_ro.get_contract.call_args_list,
+                         [call('4' * 32), call('5' * 32)])
+        cb.cache_db.put_many.assert_called_once_with([('4' * 32, True), ('5' * 32, True)])
+        # contracts are not cached one by one
+        self.assertEqual(set(c[0][0] for c in cb.cache_db.put.call_args_list), set(['1' * 32]))
+
+    @patch('openprocurement.bridge.contracting.databridge.gevent')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    @patch('openprocurement.bridge.contracting.databridge.INFINITY_LOOP')
+    def test_contracts_index(
+            self, mocked_loop, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
+        mocked_loop.__nonzero__.side_effect = [True, True, False]
+        cb = ContractingDataBridge({'main': {'contracts_index': True, 'feed_page_size': 2}})
+        cb.cache_db = MagicMock()
+        cb.cache_db.get.return_value = json.dumps({'offset': 'o1'})
+        index_client = mocked_contract_client.return_value
+        index_client.params = {}
+        index_client.get_contracts.side_effect = [
+            [{'id': '2' * 32, 'dateModified': '2017-01-02'}, {'id': '4' * 32, 'dateModified': '2017-01-03'}],
+            []]
+
+        self.assertFalse(cb.contracts_index_covers('2017-01-01'))
+        cb.sync_contracts_index()
+        self.assertEqual(cb.cache_db.put_many.call_args_list,
+                         [call([('2' * 32, True), ('4' * 32, True)])])
+        self.assertEqual(cb.contracts_index_state['synced_until'], '2017-01-03')
+        self.assertEqual(cb.metrics.get('contracts_indexed_total'), 2)
+        self.assertTrue(cb.contracts_index_covers('2017-01-01'))
+        self.assertFalse(cb.contracts_index_covers('2017-01-04'))
+
+        # contracts missing in the index are looked up only for recent tenders
+        cb.contracting_client_ro = MagicMock()
+        cb.cache_db.has_many.return_value = [False]
+        cb.tenders_sync_client = MagicMock()
+        for date_modified in ('2017-01-01', '2017-01-04'):
+            cb.tenders_queue.put({'id': '1' * 32, 'dateModified': date_modified})
+            cb.tenders_sync_client.get_tender.return_value = {'data': {
+                'id': '1' * 32, 'procuringEntity': {}, 'items': [{'id': '5' * 32}],
+                'contracts': [{'id': '3' * 32, 'status': 'active'}]}}
+            cb._get_tender_contracts()
+        self.assertEqual(cb.contracting_client_ro.get_contract.call_count, 1)
+        self.assertEqual(cb.metrics.get('contract_lookups_skipped_total'), 1)
+        self.assertEqual(cb.handicap_contracts_queue.qsize(), 1)
+
+    @patch('openprocurement.bridge.contracting.databridge.gevent')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_get_tenders_resume_from_sync_point(
+            self, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
+        cb = ContractingDataBridge({'main': {'sync_checkpoint_interval': 0}})
+        cb.cache_db = MagicMock()
+        # tenders of a killed run may be lost with memory queues
+        cb.cache_db.get.return_value = json.dumps({'forward_offset': 'f1', 'backward_offset': 'b1'})
+        self.assertEqual(cb.load_sync_point(), {})
+        cb.queues_journal = MagicMock()
+        self.assertEqual(cb.load_sync_point(), {'forward_offset': 'f1', 'backward_offset': 'b1'})
+        cb.queues_journal = None
+        cb.cache_db.get.return_value = json.dumps({'forward_offset': 'f1', 'backward_offset': 'b1', 'drained': True})
+        cb.tenders_sync_client = MagicMock()
+        requested_offsets = []
+
+        def sync_tenders(params, extra_headers):
+            requested_offsets.append(params['offset'])
+            return munchify({'data': [], 'next_page': {'offset': 'b2'}, 'prev_page': {'offset': 'f0'}})
+
+        cb.tenders_sync_client.sync_tenders.side_effect = sync_tenders
+
+        params = {'descending': 1}
+        self.assertEqual(list(cb.get_tenders(params=params, direction='backward')), [])
+        # backward sync continues from saved offset
+        self.assertEqual(requested_offsets, ['b1', 'b2'])
+        self.assertEqual(cb.initial_sync_point, {'forward_offset': 'f1', 'backward_offset': 'b1'})
+        self.assertEqual(json.loads(cb.cache_db.put.call_args_list[-1][0][1]),
+                         {'forward_offset': 'f1', 'backward_offset': None})
+
+        # finished backward sync is not repeated after workers restart
+        cb.tenders_sync_client.sync_tenders.reset_mock()
+        self.assertEqual(list(cb.get_tenders(params={'descending': 1}, direction='backward')), [])
+        self.assertEqual(cb.tenders_sync_client.sync_tenders.call_count, 0)
+
+        # full sync ignores saved sync point
+        cb = ContractingDataBridge({'main': {'full_backward_sync': True}})
+        cb.cache_db = MagicMock()
+        cb.tenders_sync_client = MagicMock()
+        cb.tenders_sync_client.sync_tenders.return_value = munchify(
+            {'data': [], 'next_page': {'offset': 'b1'}, 'prev_page': {'offset': 'f1'}})
+        cb.initialize_sync(params={'descending': 1}, direction='backward')
+        self.assertEqual(cb.cache_db.get.call_count, 0)
+        self.assertEqual(cb.initial_sync_point, {'forward_offset': 'f1', 'backward_offset': 'b1'})
+        cb.cache_db.put.assert_called_once_with(
+            'contracting_databridge_sync_point', json.dumps(cb.initial_sync_point))
+
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_forward_sync_starts_on_resume(self, mocked_contract_client, mocked_tender_client,
+                                           mocked_sync_client, mocked_logger):
+        import gevent
+        cb = ContractingDataBridge({'main': {'cache_backend': 'memory'}})
+        cb.cache_db.put('contracting_databridge_sync_point',
+                        json.dumps({'forward_offset': 'f1', 'backward_offset': 'b1', 'drained': True}))
+        requests = []
+
+        def sync_tenders(params, extra_headers):
+            requests.append(('backward' if params.get('descending') else 'forward', params['offset']))
+            return munchify({'data': [], 'next_page': {'offset': params['offset']}, 'prev_page': {'offset': 'f0'}})
+
+        mocked_sync_client.return_value.sync_tenders.side_effect = sync_tenders
+        cb._start_synchronization_workers()
+        gevent.sleep(0.01)
+        self.assertEqual(sorted(requests), [('backward', 'b1'), ('forward', 'f1')])
+
+        # restarted workers resume from the sync point in memory
+        del requests[:]
+        cb._restart_synchronization_workers()
+        gevent.sleep(0.01)
+        self.assertEqual(requests, [('forward', 'f1')])
+        gevent.killall(cb.jobs)
+
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_get_sync_delay(self, mocked_contract_client, mocked_tender_client,
+                            mocked_sync_client, mocked_db):
+        cb = ContractingDataBridge({'main': {'full_stack_sync_delay': 10,
+                                             'empty_stack_sync_delay': 100,
+                                             'feed_page_size': 100}})
+        self.assertEqual(cb.get_sync_delay(100), 0)
+        self.assertEqual(cb.get_sync_delay(75), 2.5)
+        delays = []
+        delay = 0
+        for i in range(6):
+            delay = cb.get_sync_delay(0, delay)
+            delays.append(delay)
+        self.assertEqual(delays, [10, 20, 40, 80, 100, 100])
+        # data reappeared
+        self.assertEqual(cb.get_sync_delay(100, delay), 0)
+        self.assertEqual(cb.get_sync_delay(0, 0), 10)
+
+        # pages are counted as full against the page size asked from the feed
+        cb.get_tenders = MagicMock(return_value=[])
+        with patch('openprocurement.bridge.contracting.databridge.logger'):
+            cb.get_tender_contracts_forward()
+            cb.get_tender_contracts_backward()
+        self.assertEqual([c[1]['params']['limit'] for c in cb.get_tenders.call_args_list], [100, 100])
+
+    @patch('openprocurement.bridge.contracting.databridge.gevent')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_get_tenders_filter(
+            self, mocked_contract_client, mocked_tender_client,
+            mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
+        import logging
+        tenders = [
+            {'id': '1', 'status': 'complete'},
+            {'id': '2', 'status': 'active.tendering'},
+            {'id': '3', 'status': 'complete', 'procurementMethodType': 'esco'},
+            {'id': '4', 'status': 'active', 'lots': [{'status': 'active'}, {'status': 'complete'}]},
+            {'id': '5', 'status': 'active', 'lots': [{'status': 'active'}]},
+            {'id': '6', 'status': 'active'},
+            {'id': '7', 'status': 'complete', 'procurementMethodType': 'belowThreshold'},
+        ]
+        cb = ContractingDataBridge({'main': {}})
+        cb.load_sync_point = MagicMock(return_value={})
+        cb.tenders_sync_client = MagicMock()
+        cb.tenders_sync_client.sync_tenders.side_effect = [
+            munchify({'data': tenders, 'next_page': {'offset': 'b1'}, 'prev_page': {'offset': 'f1'}}),
+            munchify({'data': [], 'next_page': {'offset': 'b1'}, 'prev_page': {'offset': 'f1'}})]
+        found = cb.get_tenders(params={'descending': 1}, direction='backward')
+        self.assertEqual([tender['id'] for tender in found], ['1', '4', '7'])
+        # skipped tenders are not logged one by one
+        mocked_logger.makeRecord.assert_any_call(
+            mocked_logger.name, logging.DEBUG, ANY, ANY, '%s sync: Skipped %s of %s tenders', ('Backward', 4, 7),
+            None, 'get_tenders', {})
+
+        cb = ContractingDataBridge({'main': {'skip_procurement_method_types': [],
+                                             'tender_statuses': ['complete']}})
+        self.assertEqual([tender['id'] for tender in tenders if cb.tender_filter(munchify(tender))],
+                         ['1', '3', '7'])
+
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_metrics(self, mocked_contract_client, mocked_tender_client,
+                     mocked_sync_client, mocked_db, mocked_logger):
+        import urllib2
+        cb = ContractingDataBridge({'main': {}})
+        cb.handicap_contracts_queue_retry.put({'id': '1'})
+        cb.client = MagicMock()
+        cb.get_tender_credentials('42')
+        cb.metrics.inc('contracts_created_total')
+        cb.metrics.inc('contracts_created_total')
+        cb.metrics.inc('tenders_skipped_total', 3, reason='filtered')
+
+        server = cb.metrics.serve('127.0.0.1', 0)
+        try:
+            response = urllib2.urlopen('http://127.0.0.1:{}/metrics'.format(server.server_port))
+            body = response.read()
+        finally:
+            server.stop()
+        lines = body.splitlines()
+        self.assertIn('# TYPE contracting_databridge_contracts_created_total counter', lines)
+        self.assertIn('contracting_databridge_contracts_created_total 2', lines)
+        self.assertIn('contracting_databridge_tenders_skipped_total{reason="filtered"} 3', lines)
+        self.assertIn('contracting_databridge_queue_size{queue="handicap_contracts_queue_retry"} 1', lines)
+        self.assertIn('contracting_databridge_queue_size{queue="tenders_queue"} 0', lines)
+        self.assertIn('contracting_databridge_request_duration_seconds_count{call="extract_credentials"} 1', lines)
+        self.assertIn('contracting_databridge_request_duration_seconds_bucket{call="extract_credentials",le="+Inf"} 1',
+                      lines)
+
+    def test_db_bulk_operations(self):
+        redis = MagicMock()
+        with patch.dict('sys.modules', {'redis': redis}):
+            db = Db({'cache_host': 'localhost'})
+        pipe = redis.StrictRedis().pipeline.return_value
+        pipe.execute.return_value = [1, 0]
+        redis.StrictRedis().mget.return_value = ['value', None]
+
+        self.assertEqual(db.has_many(['1', '2']), [True, False])
+        self.assertEqual(pipe.exists.call_args_list, [call('1'), call('2')])
+        self.assertEqual(db.get_many(['1', '2']), ['value', None])
+        redis.StrictRedis().mget.assert_called_once_with(['1', '2'])
+        db.put_many([('1', 'one'), ('2', 'two')])
+        self.assertEqual(pipe.set.call_args_list, [call('1', 'one'), call('2', 'two')])
+        self.assertEqual(pipe.execute.call_count, 2)
+
+        pipe.reset_mock()
+        self.assertEqual(db.has_many([]), [])
+        db.put_many([])
+        self.assertEqual(pipe.execute.call_count, 0)
+
+    def test_db_front_cache(self):
+        redis = MagicMock()
+        with patch.dict('sys.modules', {'redis': redis}):
+            db = Db({'cache_host': 'localhost', 'cache_front_size': 2})
+        backend = redis.StrictRedis()
+        backend.get.return_value = 'value'
+        backend.exists.return_value = True
+        pipe = backend.pipeline.return_value
+
+        self.assertEqual(db.get('1'), 'value')
+        self.assertEqual(db.get('1'), 'value')
+        backend.get.assert_called_once_with('1')
+
+        db.put('2', True)
+        self.assertTrue(db.has('2'))
+        self.assertEqual(backend.exists.call_count, 0)
+        self.assertTrue(db.has('3'))
+        self.assertTrue(db.has('3'))
+        backend.exists.assert_called_once_with('3')
+        # '1' is the least recently used key and was evicted
+        self.assertEqual(len(db.front_cache), 2)
+        pipe.execute.return_value = [0]
+        self.assertEqual(db.has_many(['1', '2', '3']), [False, True, True])
+        pipe.exists.assert_called_once_with('1')
+        self.assertEqual((db.front_cache.hits, db.front_cache.misses), (5, 3))
+
+        # keys only known to exist are read from the backend
+        backend.mget.return_value = ['three']
+        self.assertEqual(db.get_many(['2', '3']), [True, 'three'])
+        backend.mget.assert_called_once_with(['3'])
+
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    @patch('openprocurement.bridge.contracting.databridge.INFINITY_LOOP')
+    def test_multiprocess_dispatch(self, mocked_loop, mocked_contract_client, mocked_tender_client,
+                                   mocked_sync_client, mocked_db, mocked_logger):
+        import gevent
+        from openprocurement.bridge.contracting.databridge import BACKLOG_LANE, FRESH_LANE
+        from openprocurement.bridge.contracting.multiprocess import FeedBridge
+        mocked_loop.__nonzero__.side_effect = [True, True, False]
+        fb = FeedBridge({'main': {}}, '/etc/bridge.yaml', 3)
+        tender_ids = ['{:032x}'.format(i) for i in xrange(30)]
+        numbers = [fb.worker_for(tender_id) for tender_id in tender_ids]
+        self.assertEqual(numbers, [fb.worker_for(tender_id) for tender_id in tender_ids])
+        self.assertEqual(set(numbers), set([0, 1, 2]))
+
+        fb.workers = [MagicMock(), MagicMock(), MagicMock()]
+        fb.contracts_index_checked_at = 100
+        fb.contracts_index_state = {'synced_until': '2017-01-01'}
+        for tender_id in tender_ids[:2]:
+            fb.tenders_queue.put({'id': tender_id, 'dateModified': '2017-01-01'})
+        fb.dispatch_tenders()
+        worker = fb.workers[numbers[0]]
+        message = json.loads(worker.stdin.write.call_args_list[0][0][0])
+        self.assertEqual(message['tender'], {'id': tender_ids[0], 'dateModified': '2017-01-01'})
+        self.assertEqual(message['lane'], FRESH_LANE)
+        self.assertEqual(message['contracts_index'], {'state': {'synced_until': '2017-01-01'}, 'checked_at': 100})
+        if numbers[1] == numbers[0]:
+            # index state is sent once until it changes
+            self.assertNotIn('contracts_index', json.loads(worker.stdin.write.call_args_list[1][0][0]))
+
+        for number, created in enumerate((2, 3)):
+            worker = MagicMock()
+            worker.stdout.readline.side_effect = [json.dumps(
+                {'worker': number, 'tenders_queue': 1, 'pending_contracts': 4,
+                 'counters': [['contracting_databridge_contracts_created_total', [], created],
+                              ['contracting_databridge_tenders_skipped_total', [['reason', 'not_modified']], 1]]}
+            ) + '\n', '']
+            fb.read_worker_state(number, worker)
+        self.assertEqual(fb.metrics.get('contracts_created_total'), 5)
+        self.assertEqual(fb.metrics.get('tenders_skipped_total', reason='not_modified'), 2)
+        self.assertEqual(fb.workers_state[1], {'worker': 1, 'tenders_queue': 1, 'pending_contracts': 4})
+
+        # dispatched tenders are in flight until their worker releases them
+        self.assertEqual(fb.workers_in_flight[numbers[0]][tender_ids[0]],
+                         (1, {'id': tender_ids[0], 'dateModified': '2017-01-01'}))
+        self.assertFalse(fb._drained())
+        worker = MagicMock()
+        worker.stdout.readline.side_effect = [json.dumps(
+            {'worker': numbers[1], 'received': 1, 'released': [tender_ids[0], tender_ids[1]], 'counters': []}
+        ) + '\n', '']
+        fb.read_worker_state(numbers[1], worker)
+        # the second tender is sent after the report was made
+        self.assertIn(tender_ids[1], fb.workers_in_flight[numbers[1]])
+
+        # tenders in flight of a dead worker go to its replacement
+        fb.workers = [MagicMock(**{'poll.return_value': None}) for number in xrange(3)]
+        fb.workers[numbers[1]].poll.return_value = -9
+        fb.immortal_jobs = {}
+        fb._spawn_worker = MagicMock()
+        fb._check_immortal_jobs()
+        gevent.sleep(0)
+        fb._spawn_worker.assert_called_once_with(numbers[1])
+        self.assertEqual(fb.workers_in_flight[numbers[1]], {})
+        self.assertEqual(fb.tenders_queue.lane_size(BACKLOG_LANE), 1)
+        self.assertEqual(fb.tenders_queue.get()['id'], tender_ids[1])
+
+    def test_multiprocess_worker_releases_tenders(self):
+        from operator import itemgetter
+        from openprocurement.bridge.contracting.metrics import Metrics
+        from openprocurement.bridge.contracting.multiprocess import WorkerBridge
+        from openprocurement.bridge.contracting.queues import MemoryQueue
+        from openprocurement.bridge.contracting.utils import KeyedLock, PendingLedger
+        worker = WorkerBridge.__new__(WorkerBridge)
+        worker.worker_number = 0
+        worker.output = MagicMock()
+        worker.metrics = Metrics()
+        worker.tenders_queue = MemoryQueue(key=itemgetter('id'), version=itemgetter('dateModified'))
+        worker.contracts_put_queue = MemoryQueue()
+        worker.tenders_locks = KeyedLock()
+        worker.pending_contracts = PendingLedger()
+        worker.received_seq = 3
+        worker.received_ids = set(['t1', 't2', 't3'])
+        worker.held_ids = set(['t0'])
+        worker.tenders_queue.put({'id': 't1', 'dateModified': '1'})
+        worker.pending_contracts.add('c2', 't2', '1')
+
+        worker.report_state()
+        state = json.loads(worker.output.write.call_args[0][0])
+        self.assertEqual((state['received'], sorted(state['released'])), (3, ['t0', 't3']))
+        worker.tenders_queue.get()
+        worker.pending_contracts.done('c2')
+        worker.report_state()
+        state = json.loads(worker.output.write.call_args[0][0])
+        self.assertEqual(sorted(state['released']), ['t1', 't2'])
+
+    def test_queue_lanes(self):
+        from openprocurement.bridge.contracting.queues import DurableQueue, FileJournal, MemoryQueue
+        from openprocurement.bridge.contracting.databridge import BACKLOG_LANE, FRESH_LANE
+        queue = MemoryQueue(weights=(3, 1))
+        for i in xrange(4):
+            queue.put('b{}'.format(i), lane=BACKLOG_LANE)
+        for i in xrange(5):
+            queue.put('f{}'.format(i), lane=FRESH_LANE)
+        self.assertEqual((queue.qsize(), queue.lane_size(FRESH_LANE), queue.lane_size(BACKLOG_LANE)), (9, 5, 4))
+        self.assertEqual(queue.peek(), 'f0')
+        self.assertEqual([queue.get() for i in xrange(9)],
+                         ['f0', 'f1', 'f2', 'b0', 'f3', 'f4', 'b1', 'b2', 'b3'])
+
+        # backlog without weight waits for fresh items
+        queue = MemoryQueue(weights=(1, 0))
+        queue.put('b0', lane=BACKLOG_LANE)
+        queue.put('f0')
+        queue.put('f1')
+        self.assertEqual([queue.get() for i in xrange(3)], ['f0', 'f1', 'b0'])
+
+        import tempfile
+        journal = FileJournal(tempfile.mktemp())
+        queue = DurableQueue(journal, 'tenders_queue', weights=(1, 0))
+        queue.put({'id': 'b0'}, lane=BACKLOG_LANE)
+        queue = DurableQueue(journal, 'tenders_queue', weights=(1, 0))
+        queue.put({'id': 'f0'})
+        self.assertEqual([queue.get()['id'] for i in xrange(2)], ['f0', 'b0'])
+
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_replay_dead_letters(self, mocked_contract_client, mocked_tender_client,
+                                 mocked_sync_client, mocked_db, mocked_logger):
+        import tempfile
+        from openprocurement_client.client import ResourceNotFound
+        cb = ContractingDataBridge({'main': {'queue_dir': tempfile.mkdtemp()}})
+        cb.cache_db = MagicMock()
+        cb.cache_db._backend = 'lazydb'
+        cb.retry_delays.max_attempts = 2
+        contracts = [munch.munchify({'id': str(i), 'tender_id': 't{}'.format(i)}) for i in xrange(4)]
+        cb.add_dead_letter('contracts_retry_put_queue', contracts[0], Exception('Boom!'))
+        cb.add_dead_letter('handicap_contracts_queue_retry', contracts[1], Exception('Boom!'))
+        cb.add_dead_letter('contracts_retry_put_queue', contracts[2], Exception('Boom!'))
+        cb.add_dead_letter('contracts_retry_put_queue', contracts[3], Exception('Boom!'))
+        cb.dead_letters.close()
+        self.assertEqual(cb.metrics.get('contracts_dead_lettered_total'), 4)
+
+        cb.contracting_client = MagicMock()
+        # the last one was created since it failed
+        cb.contracting_client.get_contract.side_effect = [ResourceNotFound()] * 3 + [{}]
+        cb.contracting_client.create_contract.side_effect = [None, None, Exception('Again')]
+        credentials = MagicMock()
+        credentials.data = {'owner': 'broker', 'tender_token': 'token'}
+        cb.get_tender_credentials_shared = MagicMock(return_value=credentials)
+
+        self.assertEqual(cb.replay_dead_letters(concurrency=1, rate=1000), (3, 1))
+        cb.get_tender_credentials_shared.assert_called_once_with('t1')
+        self.assertEqual(cb.contracting_client.create_contract.call_args_list[1][0][0]['data'],
+                         {'id': '1', 'tender_id': 't1', 'owner': 'broker', 'tender_token': 'token'})
+        [(key, lane, letter)] = cb.dead_letters_init().load('contracts')
+        self.assertEqual((letter['contract']['id'], letter['reason'], letter['attempts']),
+                         ('2', 'Exception: Again', 4))
+
+    def test_shared_http_adapter(self):
+        from requests import Session
+        from openprocurement.bridge.contracting.benchmark.fake_api import FakeAPI
+        from openprocurement.bridge.contracting.connections import SharedHTTPAdapter
+        api = FakeAPI(tenders_count=1)
+        server = api.serve()
+        adapter = SharedHTTPAdapter(pool_size=2, idle_timeout=60)
+        try:
+            # clients made one after another reuse the same connection
+            for i in xrange(3):
+                session = Session()
+                session.mount('http://', adapter)
+                session.get(api.url + '/api/2.3/tenders').raise_for_status()
+            self.assertEqual(adapter.stats(), {'hosts': 1, 'connections_opened': 1,
+                                               'connections_reused': 2, 'requests': 3})
+            adapter.close_idle()
+            self.assertEqual(adapter.stats()['hosts'], 1)
+            adapter.idle_timeout = 0
+            adapter.close_idle()
+            self.assertEqual(adapter.stats(), {'hosts': 0, 'connections_opened': 1,
+                                               'connections_reused': 2, 'requests': 3})
+        finally:
+            server.stop()
+
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_clients_share_http_adapter(self, mocked_contract_client, mocked_tender_client,
+                                        mocked_sync_client, mocked_db):
+        cb = ContractingDataBridge({'main': {'put_contracts_workers_count': 20}})
+        self.assertEqual(cb.http_adapter._pool_maxsize, 26)
+        for client in (cb.client, cb.contracting_client, cb.tenders_sync_client):
+            client.session.mount.assert_any_call('https://', cb.http_adapter)
+            self.assertTrue(client.session.trust_env)
+        self.assertIn('contracting_databridge_http_connections_opened 0', cb.metrics.render().splitlines())
+
+        cb = ContractingDataBridge({'main': {'http_trust_env': False}})
+        self.assertFalse(cb.client.session.trust_env)
+
+    def test_journal_context(self):
+        import logging
+        import sys
+        from openprocurement.bridge.contracting.databridge import journal_context, log_event
+        from openprocurement.bridge.contracting.utils import JSONFormatter
+
+        record = {"MESSAGE_ID": DATABRIDGE_INFO}
+        self.assertEqual(journal_context(record, {"TENDER_ID": '1'}),
+                         {"MESSAGE_ID": DATABRIDGE_INFO, "JOURNAL_TENDER_ID": '1'})
+        self.assertEqual(record, {"MESSAGE_ID": DATABRIDGE_INFO})
+        # fields of one call do not leak into the next ones
+        journal_context(params={"TENDER_ID": '1'})
+        self.assertEqual(journal_context(), {})
+
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        bridge_logger = logging.getLogger('openprocurement.bridge.contracting.databridge')
+        level = bridge_logger.level
+        bridge_logger.addHandler(handler)
+        try:
+            bridge_logger.setLevel(logging.INFO)
+            with patch('openprocurement.bridge.contracting.databridge.journal_context') as mocked_context:
+                log_event(logging.DEBUG, DATABRIDGE_INFO, {"TENDER_ID": '1'}, 'Tender %s', '1')
+            self.assertEqual(mocked_context.call_count, 0)
+            bridge_logger.setLevel(logging.DEBUG)
+            lineno = sys._getframe().f_lineno + 1
+            log_event(logging.DEBUG, DATABRIDGE_INFO, {"TENDER_ID": '1'}, 'Tender %s', '1')
+            log_event(logging.DEBUG, None, None, 'Tender %s', '2')
+        finally:
+            bridge_logger.removeHandler(handler)
+            bridge_logger.setLevel(level)
+        self.assertEqual([record.getMessage() for record in records], ['Tender 1', 'Tender 2'])
+        self.assertEqual((records[0].MESSAGE_ID, records[0].JOURNAL_TENDER_ID), (DATABRIDGE_INFO, '1'))
+        self.assertFalse(hasattr(records[1], 'MESSAGE_ID'))
+        # records name the caller of the helper, as journald fields do
+        self.assertEqual([(record.funcName, record.lineno) for record in records],
+                         [('test_journal_context', lineno), ('test_journal_context', lineno + 1)])
+        self.assertEqual(records[0].pathname, __file__.replace('.pyc', '.py'))
+
+        log_record = logging.LogRecord('bridge', logging.INFO, __file__, 1, 'Created contract %s', ('42',), None)
+        log_record.__dict__.update(journal_context({"MESSAGE_ID": DATABRIDGE_INFO}, {"CONTRACT_ID": '42'}))
+        self.assertEqual(json.loads(JSONFormatter().format(log_record)),
+                         {'timestamp': log_record.created, 'level': 'INFO', 'logger': 'bridge',
+                          'message': 'Created contract 42', 'MESSAGE_ID': DATABRIDGE_INFO,
+                          'JOURNAL_CONTRACT_ID': '42'})
+        try:
+            raise ValueError('Boom!')
+        except ValueError:
+            log_record.exc_info = sys.exc_info()
+        self.assertIn('ValueError: Boom!', json.loads(JSONFormatter().format(log_record))['exception'])
+
+    def test_rate_limiter(self):
+        import gevent
+        from time import time
+        from email.utils import formatdate
+        from openprocurement_client.exceptions import RequestFailed
+        from openprocurement.bridge.contracting.utils import RateLimiter, retry_after
+
+        def error(status, headers):
+            response = MagicMock(status_code=status, headers=headers)
+            return RequestFailed(response)
+
+        self.assertEqual(retry_after(error(429, {'Retry-After': '3'})), 3)
+        self.assertAlmostEqual(retry_after(error(503, {'Retry-After': formatdate(time() + 60)})), 60, delta=2)
+        self.assertEqual(retry_after(error(429, {})), 1)
+        self.assertIsNone(retry_after(error(503, {})))
+        self.assertIsNone(retry_after(error(500, {'Retry-After': '3'})))
+        self.assertIsNone(retry_after(Exception('Boom!')))
+
+        # limiter waits on a fake clock, so only its decisions are checked
+        clock = [1000.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock[0] += seconds
+            gevent.sleep(0)
+
+        with patch('openprocurement.bridge.contracting.utils.time', lambda: clock[0]), \
+                patch('openprocurement.bridge.contracting.utils.sleep', sleep):
+            limiter = RateLimiter(rate=200, burst=1)
+            calls = []
+
+            def acquire(number):
+                with limiter:
+                    calls.append(number)
+
+            gevent.joinall([gevent.spawn(acquire, i) for i in xrange(21)])
+            # the first call takes the burst token, the next 20 wait for a token each
+            self.assertEqual(calls, range(21))
+            self.assertEqual(len(sleeps), 20)
+            self.assertAlmostEqual(clock[0] - 1000.0, 0.1)
+
+            with self.assertRaises(RequestFailed):
+                with limiter:
+                    raise error(429, {'Retry-After': '0.05'})
+            self.assertEqual(limiter.pauses, 1)
+            del sleeps[:]
+            with limiter:
+                pass
+            # the pause is waited out and the bucket is full again after it
+            self.assertEqual(len(sleeps), 1)
+            self.assertAlmostEqual(sleeps[0], 0.05)
+
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_create_contract_honors_retry_after(self, mocked_contract_client, mocked_tender_client,
+                                                mocked_sync_client, mocked_db):
+        from openprocurement_client.exceptions import RequestFailed
+        cb = ContractingDataBridge({'main': {'contracting_write_rate_limit': 5}})
+        self.assertEqual((cb.rate_limits['contracting_write'].rate, cb.rate_limits['tenders_read'].rate), (5, None))
+        cb.contracting_client.create_contract.side_effect = RequestFailed(
+            MagicMock(status_code=429, headers={'Retry-After': '30'}))
+        contract, e = cb._create_contract(munch.munchify({'id': '1', 'tender_id': '2'}))
+        self.assertIsInstance(e, RequestFailed)
+        from time import time
+        self.assertAlmostEqual(cb.rate_limits['contracting_write'].paused_until - time(), 30, delta=1)
+        self.assertEqual(cb.rate_limits['contracting_read'].paused_until, 0)
+
+    def test_circuit_breaker(self):
+        import gevent
+        from openprocurement_client.exceptions import Conflict, ResourceNotFound
+        from openprocurement.bridge.contracting.utils import CircuitBreaker
+        changes = []
+        breaker = CircuitBreaker('contracting_write', failure_threshold=2, reset_timeout=0.02,
+                                 on_change=lambda b: changes.append(b.state))
+        for error in (Exception('Boom!'), ResourceNotFound(), Conflict(), Exception('Boom!')):
+            with self.assertRaises(type(error)):
+                with breaker:
+                    raise error
+        # answers to bad requests are not failures of upstream
+        self.assertEqual((breaker.state, breaker.failures), ('closed', 1))
+        with self.assertRaises(Exception):
+            with breaker:
+                raise Exception('Boom!')
+        self.assertEqual(changes, ['open'])
+
+        # only one trial caller passes after reset timeout
+        waiters = [gevent.spawn(breaker.wait) for i in xrange(3)]
+        gevent.sleep(0.03)
+        self.assertEqual([w.ready() for w in waiters].count(True), 1)
+        self.assertEqual(breaker.state, 'half-open')
+        with self.assertRaises(Exception):
+            with breaker:
+                raise Exception('Boom!')
+        self.assertEqual(breaker.state, 'open')
+        gevent.sleep(0.03)
+        with breaker:
+            pass
+        gevent.joinall(waiters, timeout=1)
+        self.assertTrue(all(w.ready() for w in waiters))
+        self.assertEqual(changes, ['open', 'half-open', 'open', 'half-open', 'closed'])
+
+    def test_delay_queue(self):
+        import gevent
+        from openprocurement.bridge.contracting.queues import DelayQueue
+        delays = DelayQueue(base_delay=0.02, max_delay=0.04, max_attempts=3)
+        self.assertTrue(0.01 <= delays.delay(1) <= 0.02)
+        self.assertTrue(0.02 <= delays.delay(5) <= 0.04)
+        getter = gevent.spawn(delays.get)
+        delays.attempts['slow'] = 1
+        delays.schedule('slow', 'slow')
+        # later item due earlier is not held by the slow one
+        delays.schedule('fast', 'fast')
+        self.assertEqual(getter.get(timeout=1), ('fast', 'fast'))
+        self.assertEqual(delays.get(), ('slow', 'slow'))
+        self.assertEqual(delays.attempts, {'slow': 2, 'fast': 1})
+        self.assertTrue(delays.schedule('slow', 'slow'))
+        self.assertFalse(delays.schedule('slow', 'slow'))
+        delays.done('fast')
+        self.assertEqual(delays.attempts, {})
+        self.assertEqual(len(delays), 1)
+
+    def test_queue_coalesces_tenders(self):
+        import tempfile
+        from operator import itemgetter
+        from openprocurement.bridge.contracting.databridge import BACKLOG_LANE, FRESH_LANE
+        from openprocurement.bridge.contracting.queues import DurableQueue, FileJournal, MemoryQueue
+        queue = MemoryQueue(maxsize=2, key=itemgetter('id'), version=itemgetter('dateModified'))
+        queue.put({'id': 'a', 'dateModified': '2'})
+        queue.put({'id': 'b', 'dateModified': '1'})
+        # full queue takes duplicates without blocking
+        queue.put({'id': 'a', 'dateModified': '3'}, block=False)
+        queue.put({'id': 'a', 'dateModified': '1'}, block=False)
+        self.assertEqual((queue.qsize(), queue.coalesced), (2, 2))
+        self.assertEqual(queue.get(), {'id': 'a', 'dateModified': '3'})
+        # taken tender is queued again
+        queue.put({'id': 'a', 'dateModified': '4'})
+        self.assertEqual([queue.get()['id'] for i in xrange(2)], ['b', 'a'])
+
+        # fresh update of a backlog tender is not kept behind the backlog
+        queue = MemoryQueue(weights=(1, 0), key=itemgetter('id'), version=itemgetter('dateModified'))
+        queue.put({'id': 'a', 'dateModified': '1'}, lane=BACKLOG_LANE)
+        queue.put({'id': 'b', 'dateModified': '1'}, lane=BACKLOG_LANE)
+        queue.put({'id': 'b', 'dateModified': '2'}, lane=FRESH_LANE)
+        # a backlog update leaves a fresh tender in place
+        queue.put({'id': 'b', 'dateModified': '1'}, lane=BACKLOG_LANE)
+        self.assertEqual((queue.lane_size(FRESH_LANE), queue.lane_size(BACKLOG_LANE)), (1, 1))
+        self.assertEqual(queue.get_entry(), (FRESH_LANE, {'id': 'b', 'dateModified': '2'}))
+        self.assertEqual(queue.get_entry(), (BACKLOG_LANE, {'id': 'a', 'dateModified': '1'}))
+
+        journal = FileJournal(tempfile.mktemp())
+        queue = DurableQueue(journal, 'tenders_queue', key=itemgetter('id'), version=itemgetter('dateModified'))
+        queue.put({'id': 'a', 'dateModified': '1'})
+        queue.put({'id': 'a', 'dateModified': '2'})
+        self.assertEqual(journal.load('tenders_queue'), [(1, 0, {'id': 'a', 'dateModified': '2'})])
+        queue = DurableQueue(journal, 'tenders_queue', key=itemgetter('id'), version=itemgetter('dateModified'))
+        item = queue.get()
+        self.assertEqual(item, {'id': 'a', 'dateModified': '2'})
+        queue.ack(item)
+        self.assertEqual(journal.load('tenders_queue'), [])
+
+    @patch('openprocurement.bridge.contracting.databridge.gevent')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_skipped_tenders_summary(self, mocked_contract_client, mocked_tender_client,
+                                     mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
+        from openprocurement.bridge.contracting.utils import EventSummary
+        emitted = []
+        summary = EventSummary(lambda *args: emitted.append(args), interval=3600)
+        summary.add('filtered', '1')
+        summary.flush_due()
+        self.assertEqual(emitted, [])
+        summary.flush()
+        summary.flush()
+        self.assertEqual([args[:2] for args in emitted], [({'filtered': 1}, {'filtered': ['1']})])
+
+        tenders = [{'id': str(i), 'status': 'complete', 'dateModified': 'd{}'.format(i)} for i in xrange(1, 6)]
+        tenders[1]['status'] = 'active.tendering'
+        stored = {'1': 'd1', '3': 'd3', '5': 'd5'}
+
+        def sync_backward(config):
+            mocked_logger.reset_mock()
+            cb = ContractingDataBridge({'main': config})
+            cb.load_sync_point = MagicMock(return_value={})
+            cb.cache_db = MagicMock()
+            cb.cache_db.get.side_effect = stored.get
+            cb.tenders_sync_client = MagicMock()
+            cb.tenders_sync_client.sync_tenders.side_effect = [
+                munchify({'data': tenders, 'next_page': {'offset': 'b1'}, 'prev_page': {'offset': 'f1'}}),
+                munchify({'data': [], 'next_page': {'offset': 'b1'}, 'prev_page': {'offset': 'f1'}})]
+            cb.get_tender_contracts_backward()
+            self.assertEqual(cb.tenders_queue.get()['id'], '4')
+            return [c for c in mocked_logger.info.call_args_list
+                    if c[1].get('extra', {}).get('MESSAGE_ID') in ('c_bridge_skip_summary', 'c_bridge_not_modified')]
+
+        # one record for the whole sweep
+        self.assertEqual(sync_backward({'skip_summary_samples': 2}), [call(
+            'Backward sync: Skipped 4 tenders in 0s (1 filtered, 3 not modified), for example filtered 2; not modified 1, 3',
+            extra={'MESSAGE_ID': 'c_bridge_skip_summary', 'JOURNAL_SKIPPED': 4,
+                   'JOURNAL_SKIPPED_FILTERED': 1, 'JOURNAL_SKIPPED_FILTERED_SAMPLES': '2',
+                   'JOURNAL_SKIPPED_NOT_MODIFIED': 3, 'JOURNAL_SKIPPED_NOT_MODIFIED_SAMPLES': '1,3'})])
+        self.assertNotIn(call('Backward sync: Skip tender 2 in status active.tendering'),
+                         mocked_logger.debug.call_args_list)
+
+        # every tender with the debug switch
+        logged = sync_backward({'log_skipped_tenders': True})
+        self.assertEqual([c[1]['extra']['MESSAGE_ID'] for c in logged],
+                         ['c_bridge_not_modified'] * 3 + ['c_bridge_skip_summary'])
+        self.assertIn(call('Backward sync: Skip tender 2 in status active.tendering'),
+                      mocked_logger.debug.call_args_list)
+
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_backward_tenders_in_backlog_lane(self, mocked_contract_client, mocked_tender_client,
+                                              mocked_sync_client, mocked_db, mocked_logger):
+        from openprocurement.bridge.contracting.databridge import BACKLOG_LANE, FRESH_LANE
+        cb = ContractingDataBridge({'main': {'backlog_share': 0.25, 'on_error_sleep_delay': 0.001}})
+        self.assertEqual(cb.tenders_queue_weights, (3, 1))
+        self.assertEqual(ContractingDataBridge({'main': {'backlog_share': 0}}).tenders_queue_weights, (1, 0))
+        # fresh lane is never starved
+        self.assertEqual(ContractingDataBridge({'main': {'backlog_share': 0.999}}).tenders_queue_weights, (1, 99))
+        with self.assertRaises(ValueError):
+            ContractingDataBridge({'main': {'backlog_share': 1}})
+        cb.cache_db = MagicMock()
+        cb.cache_db.get.return_value = None
+        cb.get_tenders = MagicMock(side_effect=[[{'id': 'b0', 'dateModified': '1'}],
+                                                [{'id': 'f0', 'dateModified': '2'}]])
+        cb.get_tender_contracts_backward()
+        cb.get_tender_contracts_forward()
+        self.assertEqual(cb.tenders_queue.lane_size(1), 1)
+        self.assertEqual(cb.tenders_queue.get()['id'], 'f0')
+
+        # failed tender goes back into the lane it came from
+        cb.tenders_sync_client.get_tender.side_effect = Exception('Boom!')
+        cb._get_tender_contracts()
+        self.assertEqual((cb.tenders_queue.lane_size(FRESH_LANE), cb.tenders_queue.lane_size(BACKLOG_LANE)), (0, 1))
+
+    def test_durable_queue_file_journal(self):
+        import os
+        import tempfile
+        from openprocurement.bridge.contracting.queues import DurableQueue, FileJournal
+        path = os.path.join(tempfile.mkdtemp(), 'queues.log')
+        journal = FileJournal(path, compact_threshold=2)
+        queue = DurableQueue(journal, 'contracts_put_queue')
+        for i in xrange(4):
+            queue.put(munch.Munch(id=str(i)))
+        first = queue.get()
+        queue.put(first)  # put back while processed
+        queue.ack(first)
+        queue.ack(queue.get())
+        journal.close()
+
+        with open(path, 'a') as segment:
+            segment.write('["+", "contracts_put_queue", 9, {"id"')  # torn record
+        journal = FileJournal(path, compact_threshold=2)
+        queue = DurableQueue(journal, 'contracts_put_queue')
+        self.assertEqual(DurableQueue(journal, 'tenders_queue').qsize(), 0)
+        items = [queue.get() for i in xrange(3)]
+        self.assertEqual([item.id for item in items], ['2', '3', '0'])
+        for item in items:
+            queue.ack(item)
+        # segment is compacted when removed records outnumber live ones
+        with open(path) as segment:
+            self.assertEqual(segment.read(), '')
+        self.assertEqual(journal.add('tenders_queue', {'id': '1'}), 5)
+
+        # put back item is processed again before its first delivery is acknowledged
+        journal = FileJournal(os.path.join(tempfile.mkdtemp(), 'queues.log'))
+        queue = DurableQueue(journal, 'tenders_queue')
+        queue.put(munch.Munch(id='1'))
+        item = queue.get()
+        queue.put(item)
+        self.assertIs(queue.get(), item)
+        queue.ack(item)
+        self.assertEqual(len(journal.load('tenders_queue')), 1)
+        queue.ack(item)
+        self.assertEqual(journal.load('tenders_queue'), [])
+
+    def test_durable_queue_blocked_put(self):
+        import gevent
+        import tempfile
+        from operator import itemgetter
+        from openprocurement.bridge.contracting.queues import DurableQueue, FileJournal
+
+        class SwitchingJournal(FileJournal):
+            # journal of redis backend switches greenlets on writes
+            switching = ('add', 'remove')
+
+            def add(self, name, item, lane=0):
+                if 'add' in self.switching:
+                    gevent.sleep(0)
+                return FileJournal.add(self, name, item, lane)
+
+            def remove(self, name, key):
+                if 'remove' in self.switching:
+                    gevent.sleep(0)
+                FileJournal.remove(self, name, key)
+
+        journal = SwitchingJournal(tempfile.mktemp())
+        queue = DurableQueue(journal, 'contracts_put_queue', maxsize=1)
+        queue.put(munch.Munch(id='1'))
+        blocked = gevent.spawn(queue.put, munch.Munch(id='2'))
+        gevent.sleep(0.01)
+        # the hub hands the freed slot to the blocked put
+        queue.ack(queue.get())
+        blocked.get(timeout=1)
+        self.assertEqual(queue.get().id, '2')
+        self.assertEqual([item['id'] for key, lane, item in journal.load('contracts_put_queue')], ['2'])
+
+        # item coalesced by the hub leaves the journal once its put returns
+        journal.switching = ('remove',)
+        queue = DurableQueue(journal, 'tenders_queue', maxsize=2,
+                             key=itemgetter('id'), version=itemgetter('dateModified'))
+        queue.put({'id': 'x', 'dateModified': '1'})
+        queue.put({'id': 'y', 'dateModified': '1'})
+        blocked = gevent.spawn(queue.put, {'id': 'a', 'dateModified': '1'})
+        gevent.sleep(0.01)
+        x = queue.get()
+        # a newer version takes the freed slot before the blocked put
+        queue.put({'id': 'a', 'dateModified': '2'})
+        queue.ack(x)
+        queue.ack(queue.get())
+        blocked.get(timeout=1)
+        self.assertEqual(queue.get(), {'id': 'a', 'dateModified': '2'})
+        self.assertEqual([item for key, lane, item in journal.load('tenders_queue')],
+                         [{'id': 'a', 'dateModified': '2'}])
+
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    def test_get_tender_contracts_acks_failed_tender(self, mocked_contract_client, mocked_tender_client,
+                                                     mocked_sync_client, mocked_logger):
+        import tempfile
+        cb = ContractingDataBridge({'main': {'cache_backend': 'memory', 'queue_backend': 'file',
+                                             'queue_dir': tempfile.mkdtemp()}})
+        cb.tenders_queue.put({'id': 't1', 'dateModified': '1'})
+
+        def sync_tender_contracts(tender, lane):
+            if cb._sync_tender_contracts.call_count == 1:
+                cb.tenders_queue.put(tender, lane=lane)
+                raise Exception('Boom!')
+
+        cb._sync_tender_contracts = MagicMock(side_effect=sync_tender_contracts)
+        with self.assertRaises(Exception):
+            cb._get_tender_contracts()
+        cb._get_tender_contracts()
+        self.assertEqual(cb._sync_tender_contracts.call_count, 2)
+        self.assertEqual(cb.queues_journal.load('tenders_queue'), [])
+
+    @patch('openprocurement.bridge.contracting.databridge.gevent')
+    @patch('openprocurement.bridge.contracting.databridge.logger')
+    @patch('openprocurement.bridge.contracting.databridge.Db')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClientSync')
+    @patch('openprocurement.bridge.contracting.databridge.TendersClient')
+    @patch('openprocurement.bridge.contracting.databridge.ContractingClient')
+    @patch('openprocurement.bridge.contracting.databridge.INFINITY_LOOP')
+    def test_run_drains_on_stop(self, mocked_loop, mocked_contract_client, mocked_tender_client,
+                                mocked_sync_client, mocked_db, mocked_logger, mocked_gevent):
+        mocked_loop.__nonzero__.side_effect = [True] * 10
+        cb = ContractingDataBridge({'main': {}})
+        cb.cache_db = MagicMock()
+        cb.sync_point = {'forward_offset': 'f1', 'backward_offset': 'b1'}
+        cb.contracts_put_queue.put({'id': '1'})
+        cb._check_synchronization_workers = MagicMock(side_effect=cb.stop)
+        ticks = []
+
+        def sleep(seconds):
+            ticks.append(seconds)
+            if len(ticks) == 3:
+                cb.contracts_put_queue.get()
+
+        mocked_gevent.sleep.side_effect = sleep
+        cb.run()
+
+        mocked_gevent.signal.assert_called_once_with(signal.SIGTERM, cb.stop)
+        self.assertEqual(cb._check_synchronization_workers.call_count, 1)
+        # both sync workers are the same mocked greenlet
+        self.assertEqual(cb.jobs[0].kill.call_args_list, [call(block=False)] * 2)
+        cb.cache_db.put.assert_any_call('contracting_databridge_sync_point', json.dumps(cb.sync_point))
+        # next run may resume from the sync point saved after the drain
+        self.assertEqual(json.loads(cb.cache_db.put.call_args_list[-1][0][1]),
+                         {'forward_offset': 'f1', 'backward_offset': 'b1', 'drained': True})
+        # the queue is drained on the third tick
+        self.assertEqual(ticks, [15, 1, 1])
+        mocked_logger.info.assert_any_call('Pipeline is drained', extra=ANY)
+        mocked_logger.info.assert_any_call('Exiting...')
+
+    def test_fake_api(self):
+        from openprocurement.bridge.contracting.benchmark.fake_api import FakeAPI
+        api = FakeAPI(tenders_count=5, contracts_per_tender=2, existing_ratio=0.5, seed=1)
+        self.assertEqual(api.to_create + len(api.contracts), 10)
+
+        status, page = api.handle('GET', '/api/2.3/tenders', {'limit': '2', 'descending': '1'}, '')
+        self.assertEqual([t['id'] for t in page['data']], [api.tenders[4]['id'], api.tenders[3]['id']])
+        self.assertEqual(page['next_page']['offset'], 3)
+        status, page = api.handle('GET', '/api/2.3/tenders', {'limit': '2', 'offset': '4'}, '')
+        self.assertEqual([t['id'] for t in page['data']], [api.tenders[4]['id']])
+        self.assertEqual(page['next_page']['offset'], 5)
+
+        contract = api.tenders[0]['contracts'][0]
+        existed = contract['id'] in api.contracts
+        self.assertEqual(api.handle('GET', '/api/2.3/contracts/' + contract['id'], {}, '')[0],
+                         200 if existed else 404)
+        body = json.dumps({'data': contract})
+        self.assertEqual(api.handle('POST', '/api/2.3/contracts', {}, body)[0], 409 if existed else 201)
+        self.assertEqual(api.handle('POST', '/api/2.3/contracts', {}, body)[0], 409)
+
+    def test_histogram_quantile(self):
+        from openprocurement.bridge.contracting.metrics import Histogram
+        histogram = Histogram(buckets=(1, 2, 4))
+        self.assertEqual(histogram.quantile(0.5), 0.0)
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.quantile(0.25), 1)
+        self.assertEqual(histogram.quantile(0.5), 1.5)
+        self.assertEqual(histogram.quantile(1), 4)
+
 
 def suite():
     suite = unittest.TestSuite()
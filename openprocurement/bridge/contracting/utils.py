@@ -0,0 +1,452 @@
+import json
+import logging
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
+from time import time
+
+from gevent import GreenletExit, sleep, spawn
+from gevent.event import Event
+from gevent.lock import Semaphore
+from gevent.pool import Pool
+from gevent.queue import Queue
+
+
+class KeyedLock(object):
+    """ Per-key lock shared between greenlets """
+
+    def __init__(self):
+        self._locks = {}
+
+    @contextmanager
+    def __call__(self, key):
+        lock, waiters = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = Semaphore()
+        self._locks[key] = (lock, waiters + 1)
+        acquired = False
+        try:
+            # a waiter killed in acquire() gives up its count too
+            acquired = lock.acquire()
+            yield
+        finally:
+            if acquired:
+                lock.release()
+            lock, waiters = self._locks[key]
+            if waiters == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, waiters - 1)
+
+    def locked(self, key):
+        return key in self._locks
+
+    def keys(self):
+        return self._locks.keys()
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class TTLCache(object):
+    """ Size limited in-memory LRU cache with expiring entries """
+
+    def __init__(self, ttl, maxsize=1000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        value, expires = self._data.pop(key, (default, None))
+        if expires is None or expires < time():
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data[key] = (value, expires)
+        return value
+
+    def put(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (value, time() + self.ttl)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+def is_upstream_failure(error):
+    """ Tell errors of a failing upstream from answers to a bad request """
+    status = getattr(error, 'status_code', None) or getattr(error, 'status_int', None)
+    return status is None or status >= 500 or status == 429
+
+
+def is_conflict(error):
+    """ Tell a 409 answer, e.g. to create an object which already exists """
+    return (getattr(error, 'status_code', None) or getattr(error, 'status_int', None)) == 409
+
+
+def retry_after(error):
+    """ Seconds to wait after error of a 429 or 503 response, None for other errors
+
+    Retry-After is read as seconds or as a date, 429 without it waits a
+    second.
+    """
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status not in (429, 503):
+        return None
+    value = (getattr(response, 'headers', None) or {}).get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is not None:
+                return max(0.0, mktime_tz(date) - time())
+    return 1.0 if status == 429 else None
+
+
+class RateLimiter(object):
+    """ Token bucket shared by all calls of one kind
+
+    The bucket gets `rate` tokens per second up to `burst` and every call
+    takes one, waiting in line while the bucket is empty. Calls made in
+    the limiter context stop the bucket for the Retry-After time of 429
+    and 503 responses. Without `rate` calls wait for Retry-After only.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time()
+        self.paused_until = 0
+        self.pauses = 0
+        self.waited = 0.0
+
+    def acquire(self):
+        started = time()
+        while time() < self.paused_until:
+            sleep(self.paused_until - time())
+        if self.rate:
+            now = time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # token is taken in advance, so callers are served in order
+            self.tokens -= 1
+            if self.tokens < 0:
+                sleep(-self.tokens / self.rate)
+        self.waited += time() - started
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time() + seconds)
+        self.pauses += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = retry_after(exc_value) if exc_type is not None else None
+        if seconds is not None:
+            self.pause(seconds)
+
+
+class CircuitBreaker(object):
+    """ Closed, open and half-open states of calls to one upstream
+
+    Calls are made inside the breaker context. The breaker opens after
+    `failure_threshold` failures in a row and callers block in `wait`
+    while it is open. After `reset_timeout` one waiting caller is let
+    through: success of its call closes the breaker and failure opens it
+    again. `on_change` is called with the breaker on every state change.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, name, failure_threshold=10, reset_timeout=30,
+                 is_failure=is_upstream_failure, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.on_change = on_change
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_at = None
+        self._changed = Event()
+
+    def _set_state(self, state):
+        if state == self.OPEN:
+            self.trial_at = time() + self.reset_timeout
+        if state != self.state:
+            self.state = state
+            self._changed.set()
+            if self.on_change is not None:
+                self.on_change(self)
+
+    def wait(self):
+        """ Block until a call may be made """
+        while self.state != self.CLOSED:
+            delay = self.trial_at - time()
+            if delay <= 0:
+                # the next trial is let through if this one never reports
+                self.trial_at = time() + self.reset_timeout
+                self._set_state(self.HALF_OPEN)
+                return
+            self._changed.clear()
+            self._changed.wait(delay)
+
+    def success(self):
+        self.failures = 0
+        self._set_state(self.CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                            self.failures >= self.failure_threshold):
+            self._set_state(self.OPEN)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or not self.is_failure(exc_value):
+            self.success()
+        else:
+            self.failure()
+
+
+class TenderFilter(object):
+    """ Predicate that selects feed tenders with contracts to sync
+
+    A tender with lots is selected when any of its lots is in one of
+    `lot_statuses`, a tender without lots when its own status is in
+    `nolot_statuses`.
+    """
+
+    opt_fields = 'status,lots,procurementMethodType'
+
+    def __init__(self, statuses, skip_procurement_method_types,
+                 lot_statuses, nolot_statuses):
+        self.statuses = frozenset(statuses)
+        self.skip_procurement_method_types = frozenset(skip_procurement_method_types)
+        self.lot_statuses = frozenset(lot_statuses)
+        self.nolot_statuses = frozenset(nolot_statuses)
+
+    def __call__(self, tender):
+        if tender['status'] not in self.statuses:
+            return False
+        if tender.get('procurementMethodType') in self.skip_procurement_method_types:
+            return False
+        if 'lots' in tender:
+            lot_statuses = self.lot_statuses
+            return any(lot['status'] in lot_statuses for lot in tender['lots'])
+        return tender['status'] in self.nolot_statuses
+
+
+class EventSummary(object):
+    """ Counts of frequent events by reason with a few sample ids
+
+    Events are counted until `flush` passes the counts, sample ids and
+    length of the window to `emit` and starts a new window. `flush_due`
+    does it only once the window is `interval` seconds old.
+    """
+
+    def __init__(self, emit, interval=60, samples=5):
+        self.emit = emit
+        self.interval = interval
+        self.samples = samples
+        self._reset()
+
+    def _reset(self):
+        self.started = time()
+        self.counts = Counter()
+        self.sample_ids = {}
+
+    def add(self, reason, item_id):
+        self.counts[reason] += 1
+        sample_ids = self.sample_ids.setdefault(reason, [])
+        if len(sample_ids) < self.samples:
+            sample_ids.append(item_id)
+
+    def flush(self):
+        if self.counts:
+            self.emit(dict(self.counts), self.sample_ids, time() - self.started)
+        self._reset()
+
+    def flush_due(self):
+        if time() - self.started >= self.interval:
+            self.flush()
+
+
+def imap_ordered(func, iterable, size):
+    """ Run `func` over `iterable` in a pool of `size` greenlets
+
+    Results are yielded in the order of the input items and no more than
+    `size` finished results are kept waiting for the consumer, so a slow
+    consumer holds back reading of the input.
+    """
+    pool = Pool(size)
+    results = Queue(maxsize=size)
+
+    def feed():
+        try:
+            for item in iterable:
+                results.put(pool.spawn(func, item))
+        except GreenletExit:
+            return
+        except Exception:
+            results.put(StopIteration)
+            raise
+        results.put(StopIteration)
+
+    feeder = spawn(feed)
+    try:
+        for job in results:
+            yield job.get()
+        feeder.join()
+        if feeder.exception is not None:
+            raise feeder.exception
+    finally:
+        feeder.kill()
+        pool.kill()
+
+
+def paced(iterable, rate):
+    """ Yield items of `iterable` no faster than `rate` items per second """
+    interval = 1.0 / rate if rate else 0
+    next_at = time()
+    for item in iterable:
+        if next_at > time():
+            sleep(next_at - time())
+        next_at = max(next_at, time()) + interval
+        yield item
+
+
+class PendingLedger(object):
+    """ Contracts that are not synced yet, grouped by tender
+
+    Every contract keeps the tender dateModified it was found with. A
+    tender is done when the last of its pending contracts is done. When
+    a contract fails permanently or the ledger is over its size limit the
+    whole tender group is dropped, so the tender is never reported done
+    with unsynced contracts.
+    """
+
+    def __init__(self, maxsize=100000, max_age=None):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.evicted = 0
+        self.expired = 0
+        self.failed = 0
+        self._contracts = OrderedDict()
+        self._tenders = {}
+
+    def __len__(self):
+        return len(self._contracts)
+
+    def __contains__(self, contract_id):
+        return contract_id in self._contracts
+
+    @property
+    def tenders_count(self):
+        return len(self._tenders)
+
+    def oldest_age(self):
+        for tender_id, date_modified, added in self._contracts.itervalues():
+            return time() - added
+        return 0
+
+    def tender_ids(self):
+        return self._tenders.keys()
+
+    def tenders(self):
+        tenders = OrderedDict()
+        for tender_id, date_modified, added in self._contracts.itervalues():
+            tenders.setdefault(tender_id, date_modified)
+        return tenders.items()
+
+    def add(self, contract_id, tender_id, date_modified, added=None):
+        self._pop(contract_id)
+        self._contracts[contract_id] = (tender_id, date_modified, added or time())
+        self._tenders.setdefault(tender_id, set()).add(contract_id)
+        while len(self._contracts) > self.maxsize:
+            self.evicted += self._drop_tender(next(self._contracts.itervalues())[0])
+
+    def done(self, contract_id):
+        """ Remove synced contract
+
+        Return tender dateModified when it was the last pending contract
+        of its tender.
+        """
+        entry = self._pop(contract_id)
+        if entry is not None and entry[0] not in self._tenders:
+            return entry[1]
+
+    def fail(self, contract_id):
+        entry = self._contracts.get(contract_id)
+        if entry is not None:
+            self.failed += self._drop_tender(entry[0])
+
+    def expire(self):
+        if not self.max_age:
+            return
+        while self._contracts:
+            tender_id, date_modified, added = next(self._contracts.itervalues())
+            if time() - added < self.max_age:
+                break
+            self.expired += self._drop_tender(tender_id)
+
+    def dump(self):
+        return [[contract_id] + list(entry) for contract_id, entry in self._contracts.items()]
+
+    def load(self, entries):
+        for contract_id, tender_id, date_modified, added in entries:
+            self.add(contract_id, tender_id, date_modified, added)
+
+    def _pop(self, contract_id):
+        entry = self._contracts.pop(contract_id, None)
+        if entry is not None:
+            contracts = self._tenders[entry[0]]
+            contracts.discard(contract_id)
+            if not contracts:
+                del self._tenders[entry[0]]
+        return entry
+
+    def _drop_tender(self, tender_id):
+        contracts = self._tenders.pop(tender_id, ())
+        for contract_id in contracts:
+            del self._contracts[contract_id]
+        return len(contracts)
+
+
+# attributes of every log record, the others are given in `extra`
+RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | frozenset(('message', 'asctime'))
+
+
+class JSONFormatter(logging.Formatter):
+    """ Formats log records as JSON lines
+
+    Fields given in `extra` of the logging call, like journal fields, go
+    along with the time, level, logger name and message of the record.
+    """
+
+    def __init__(self, fmt=None, datefmt=None):
+        super(JSONFormatter, self).__init__(fmt, datefmt)
+        self.encoder = json.JSONEncoder(default=str)
+
+    def format(self, record):
+        data = {'timestamp': record.created, 'level': record.levelname,
+                'logger': record.name, 'message': record.getMessage()}
+        fields = record.__dict__
+        for key in fields.viewkeys() - RECORD_ATTRIBUTES:
+            data[key] = fields[key]
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return self.encoder.encode(data)
@@ -22,7 +22,8 @@ docs_requires = requires + [
 
 entry_points = {
     'console_scripts': [
-        'contracting_data_bridge = openprocurement.bridge.contracting.databridge:main'
+        'contracting_data_bridge = openprocurement.bridge.contracting.databridge:main',
+        'contracting_data_bridge_benchmark = openprocurement.bridge.contracting.benchmark.run:main'
     ],
 }
 